@@ -11,6 +11,32 @@ class Settings(BaseSettings):
     )
 
     OPEN_WEATHER_API_KEY: str = os.getenv("OPEN_WEATHER_API_KEY")
+    OPEN_WEATHER_BASE_URL: str = "https://api.openweathermap.org/data/2.5/weather"
+    OPEN_WEATHER_CONNECT_TIMEOUT_SECONDS: float = 3
+    OPEN_WEATHER_READ_TIMEOUT_SECONDS: float = 5
+    OPEN_WEATHER_MAX_CONNECTIONS: int = 20
+    OPEN_WEATHER_MAX_RETRIES: int = 2
+    OPEN_WEATHER_RETRY_BACKOFF_SECONDS: float = 0.5
+    # Consecutive failed calls that open the circuit, and how long it stays open
+    OPEN_WEATHER_BREAKER_FAILURES: int = 5
+    OPEN_WEATHER_BREAKER_RESET_SECONDS: float = 30
+    # Upstream responses are fresh for the TTL and then served stale, while
+    # they are refreshed, for up to WEATHER_CACHE_STALE_SECONDS more
+    WEATHER_CACHE_TTL_SECONDS: float = 120
+    WEATHER_CACHE_STALE_SECONDS: float = 600
+    WEATHER_CACHE_MAX_ENTRIES: int = 1_000
+    # Devices are grouped in geohash cells of this precision for local
+    # weather, 5 is a cell of about 4.9 x 4.9 km
+    WEATHER_GEOHASH_PRECISION: int = 5
+    # Locations stored by the background scheduler, as JSON:
+    # [{"city_name": "Medellin", "country_code": "CO", "interval_seconds": 60}]
+    WEATHER_LOCATIONS: list[dict] = [{"city_name": "Medellin"}]
+    WEATHER_POLL_INTERVAL_SECONDS: float = 10
+    WEATHER_POLL_JITTER_SECONDS: float = 2
+    WEATHER_MAX_CONCURRENT_REQUESTS: int = 10
+    # An unchanged observation is stored anyway once this long has passed
+    # since the last stored one of its city
+    WEATHER_DEDUP_MAX_INTERVAL_SECONDS: float = 600
 
     PROJECT_NAME: str = "backend"
     PROJECT_VERSION: str = "0.1"
@@ -21,8 +47,55 @@ class Settings(BaseSettings):
     POSTGRES_SERVER: str = os.getenv("POSTGRES_SERVER")
     POSTGRES_HOST: str = os.getenv("POSTGRES_HOST")
     POSTGRES_PORT: str = os.getenv("POSTGRES_PORT")
-    # DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
     DATABASE_URL: str = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    ASYNC_DATABASE_URL: str = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+
+    # Write-behind ingestion for POST /data
+    INGEST_BUFFER_ENABLED: bool = False
+    INGEST_BUFFER_MAX_SIZE: int = 10_000
+    INGEST_BUFFER_PUT_TIMEOUT_SECONDS: float = 0.5
+    INGEST_FLUSH_INTERVAL_MS: int = 200
+    INGEST_FLUSH_MAX_ROWS: int = 1_000
+
+    DEVICE_REGISTRY_REFRESH_SECONDS: int = 60
+    # How long a cached setpoint is served when BROADCAST_BACKEND is not
+    # shared between workers, a change made by another worker stays unseen
+    # up to this long
+    SETPOINT_CACHE_TTL_SECONDS: float = 5
+
+    # Postgres range partitions of datamodel on created_date (one per day)
+    DATA_PARTITIONING_ENABLED: bool = False
+    DATA_PARTITION_PREMAKE_DAYS: int = 7
+    # Raw partitions older than this are compacted into the rollups and
+    # dropped, 0 keeps them forever
+    DATA_RETENTION_DAYS: int = 0
+    DATA_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+
+    # Hourly/daily rollups of datamodel updated on every insert
+    DATA_ROLLUPS_ENABLED: bool = True
+    # Longer gaps between two readings do not count as valve ON time
+    ROLLUP_VALVE_MAX_GAP_SECONDS: int = 300
+
+    # Outgoing messages queued per websocket, when full the slow consumer
+    # policy applies: "drop_oldest" or "disconnect"
+    WS_SEND_QUEUE_SIZE: int = 100
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    WS_SEND_TIMEOUT_SECONDS: float = 10
+    # "memory" serves the clients of this worker only, "postgres" shares the
+    # messages between workers with LISTEN/NOTIFY
+    BROADCAST_BACKEND: str = "memory"
+    BROADCAST_CHANNEL: str = "iot_data"
+    BROADCAST_FLUSH_INTERVAL_MS: int = 50
+    # Messages waiting for the next NOTIFY, further ones are dropped
+    BROADCAST_MAX_PENDING: int = 10_000
+    # Setpoint changes, so every worker drops its cached setpoint
+    SETPOINT_BROADCAST_CHANNEL: str = "iot_setpoints"
+
+    # Rows fetched per round trip by the server-side cursors of the streams
+    STREAM_BATCH_SIZE: int = 2_000
 
 
 settings = Settings()
@@ -1,18 +1,23 @@
 # SQLModel based on pydantic and SQLalchemy
 import logging
-from typing import Generator
+from typing import AsyncGenerator
 
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import settings
+from app.db.upgrade import upgrade_schema
 
 log = logging.getLogger("uvicorn")
 
 DATABASE_URL = settings.DATABASE_URL
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL
 
+# Sync engine, the tests create and drop the tables with it
 engine = create_engine(
     DATABASE_URL,
-    echo=True,  # Return all doing in the db
+    echo=settings.DB_ECHO,  # Return all doing in the db
     future=True,
     pool_pre_ping=True,
     isolation_level="AUTOCOMMIT",
@@ -21,6 +26,19 @@ engine = create_engine(
     # execution_options={"compiled_cache": None, "autocomit": True},
 )
 
+# Async engine (asyncpg) used by the routers
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=settings.DB_ECHO,
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+
+async_session_maker = async_sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
 
 def init_db():
     """
@@ -34,9 +52,23 @@ def init_db():
         print(f"{__name__}: An exception occurred {e}")
 
 
-def get_session() -> Generator:
+async def init_async_db():
+    """
+    initialization of the database async, creates the missing tables and
+    upgrades the ones left by older versions (see app.db.upgrade)
+    """
     try:
-        with Session(engine) as session:
-            yield session
-    finally:
-        session.close()
+        async with async_engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+            await upgrade_schema(conn)
+    except Exception as e:
+        print(f"{__name__}: An exception occurred {e}")
+
+
+async def get_async_session() -> AsyncGenerator:
+    """
+    Async session dependency, tests can swap the database by overriding it
+    (`app.dependency_overrides`) or by setting ASYNC_DATABASE_URL.
+    """
+    async with async_session_maker() as session:
+        yield session
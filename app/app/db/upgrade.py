@@ -0,0 +1,113 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import DateTime, text
+from sqlmodel import SQLModel
+
+log = logging.getLogger("uvicorn")
+
+# Serializes the upgrade of several workers starting together
+UPGRADE_LOCK_KEY = 7_301_002
+# Naive timestamps were always stored as Bogota wall time
+STORED_TIME_ZONE = "America/Bogota"
+
+
+async def _columns_of_type(
+    conn, table: str, data_type: Optional[str] = None
+) -> set[str]:
+    """
+    Columns of the table, only the ones of `data_type` when given.
+    """
+    statement = (
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table"
+    )
+    if data_type is not None:
+        statement += " AND data_type = :data_type"
+    result = await conn.execute(
+        text(statement), {"table": table, "data_type": data_type}
+    )
+    return {name for (name,) in result}
+
+
+async def upgrade_columns(conn):
+    """
+    Adds the nullable columns that the models gained after their table was
+    created (DeviceModel.latitude/longitude). Missing NOT NULL columns would
+    need a backfill, they are only reported.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        existing = await _columns_of_type(conn, table.name)
+        if not existing:
+            continue
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                log.error(f"{table.name}.{column.name} is missing and NOT NULL")
+                continue
+            log.info(f"Adding {table.name}.{column.name}")
+            column_type = column.type.compile(dialect=conn.dialect)
+            await conn.execute(
+                text(
+                    f"ALTER TABLE {table.name} "
+                    f'ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                )
+            )
+
+
+async def upgrade_indexes(conn):
+    """
+    Creates the indexes that the models declare and the table lacks, such as
+    the (device_mac, created_at) and (city_name, created_at) ones.
+    """
+
+    def create_missing(sync_conn):
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(sync_conn, checkfirst=True)
+
+    await conn.run_sync(create_missing)
+
+
+async def upgrade_timestamps(conn):
+    """
+    Turns the `timestamp without time zone` columns that the models declare
+    as timezone aware into timestamptz, reading the stored values as Bogota
+    time. Columns already converted are skipped, so it can run on every
+    startup.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        naive = await _columns_of_type(conn, table.name, "timestamp without time zone")
+        for column in table.columns:
+            if not (
+                column.name in naive
+                and isinstance(column.type, DateTime)
+                and column.type.timezone
+            ):
+                continue
+            log.info(f"Converting {table.name}.{column.name} to timestamptz")
+            await conn.execute(
+                text(
+                    f'ALTER TABLE {table.name} ALTER COLUMN "{column.name}" '
+                    f'TYPE timestamptz USING "{column.name}" '
+                    f"AT TIME ZONE '{STORED_TIME_ZONE}'"
+                )
+            )
+
+
+async def upgrade_schema(conn):
+    """
+    Brings the tables of a database created by an older version up to the
+    models, create_all only creates the missing tables. Postgres only.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    # Another worker may be converting the same columns, converting a
+    # timestamptz column again would shift its values
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": UPGRADE_LOCK_KEY}
+    )
+    await upgrade_columns(conn)
+    await upgrade_timestamps(conn)
+    await upgrade_indexes(conn)
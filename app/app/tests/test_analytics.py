@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from iot.analytics import correlate, join_asof
+
+
+def test_join_asof_and_lagged_correlation():
+    weather_times = pd.date_range("2024-01-01", periods=48, freq="1h", tz="UTC")
+    weather_temperature = 20 + 5 * np.sin(np.arange(48) / 4)
+    weather = pd.DataFrame(
+        {
+            "created_at": weather_times,
+            "temperature": weather_temperature,
+            "humidity": 80 - weather_temperature,
+            "pressure": 1000.0 + np.arange(48) % 3,
+            "wind_speed": np.arange(48) % 5,
+        }
+    )
+    # The device follows the outdoor temperature two hours later, the last
+    # reading is more than the tolerance after the last observation
+    reading_times = weather_times + timedelta(minutes=10)
+    reading_times = reading_times.append(
+        pd.DatetimeIndex([weather_times[-1] + timedelta(hours=3)])
+    )
+    readings = pd.DataFrame(
+        {
+            "created_at": reading_times,
+            "temperature": np.r_[np.full(2, 20.0), weather_temperature[:-2], 20.0],
+            "humidity_1": np.linspace(0, 1, 49),
+            "humidity_2": np.full(49, 1.0),
+            "valve_on": np.arange(49) % 2,
+        }
+    )
+
+    joined = join_asof(readings, weather, tolerance=timedelta(hours=1))
+    result = correlate(joined, max_lag_hours=3)
+
+    assert result["matched"] == 48
+    assert (joined["weather_temperature"] == weather_temperature).all()
+    assert result["correlations"]["humidity_2"]["temperature"] is None
+    lagged = {
+        lag["lag_hours"]: lag["correlations"]["temperature"]["temperature"]
+        for lag in result["lagged"]
+    }
+    assert max(lagged, key=lagged.get) == 2
+    assert lagged[2] == 1.0
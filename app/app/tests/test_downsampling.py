@@ -0,0 +1,30 @@
+import numpy as np
+
+from app.utils.downsampling import downsample_indices, lttb
+
+
+def test_lttb_keeps_ends_and_spikes():
+    x = np.arange(10_000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321] = -10.0
+
+    index = lttb(x, y, 100)
+
+    assert len(index) == 100
+    assert index[0] == 0 and index[-1] == 9_999
+    assert (np.diff(index) > 0).all()
+    assert 4321 in index
+
+
+def test_downsample_indices_is_bounded():
+    x = np.arange(5_000, dtype=float)
+    series = {
+        "humidity": np.cos(x / 300),
+        "valve_on": (x % 1_000 < 50).astype(float),
+    }
+
+    index = downsample_indices(x, series, 60)
+
+    assert len(index) <= 60
+    short = {name: values[:40] for name, values in series.items()}
+    assert downsample_indices(x[:40], short, 60).tolist() == list(range(40))
@@ -0,0 +1,105 @@
+import asyncio
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import iot.ingest_buffer
+from iot.crud import data_crud
+from iot.ingest_buffer import IngestBuffer
+from iot.models import DataCreate, DataModel
+
+
+async def sqlite_session_maker(path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    return engine, async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+def reading(temperature):
+    return DataCreate(
+        temperature=temperature,
+        humidity_1=50,
+        humidity_2=60,
+        valve_status="ON",
+        device_mac="00:1B:44:11:3A:B7",
+    )
+
+
+def run_buffer(tmp_path, monkeypatch, readings, wait: float = 0):
+    """
+    Queues the readings in a started buffer and stops it after `wait`
+    seconds, returns the stored row count and the buffer.
+    """
+
+    async def run():
+        engine, session_maker = await sqlite_session_maker(tmp_path / "ingest.db")
+        monkeypatch.setattr(iot.ingest_buffer, "async_session_maker", session_maker)
+        buffer = IngestBuffer(
+            max_size=100, flush_interval_ms=200, flush_max_rows=1_000, put_timeout=1
+        )
+        buffer.start()
+        for data in readings:
+            await buffer.put(data)
+        await asyncio.sleep(wait)
+        await buffer.stop()
+        async with session_maker() as session:
+            result = await session.exec(select(func.count()).select_from(DataModel))
+            count = result.one()
+        await engine.dispose()
+        return count, buffer
+
+    return asyncio.run(run())
+
+
+def test_readings_are_written_in_one_batch(tmp_path, monkeypatch):
+    count, buffer = run_buffer(
+        tmp_path, monkeypatch, [reading(i) for i in range(5)], wait=0.5
+    )
+
+    assert count == 5
+    assert buffer.metrics["flushes"] == 1
+    assert buffer.metrics["flushed_rows"] == 5
+    assert not buffer.running
+
+
+def test_stop_writes_the_queued_readings(tmp_path, monkeypatch):
+    count, buffer = run_buffer(tmp_path, monkeypatch, [reading(i) for i in range(5)])
+
+    assert count == 5
+    assert buffer.metrics["failed_rows"] == 0
+    assert not buffer.running
+
+
+def test_bad_reading_only_loses_itself(tmp_path, monkeypatch):
+    readings = [reading(i) for i in range(10)]
+    # Skips validation, the NOT NULL constraint rejects it
+    readings[3] = DataCreate.model_construct(
+        **{**readings[3].model_dump(), "temperature": None}
+    )
+
+    count, buffer = run_buffer(tmp_path, monkeypatch, readings)
+
+    assert count == 9
+    assert buffer.metrics["flushed_rows"] == 9
+    assert buffer.metrics["failed_rows"] == 1
+
+
+def test_database_outage_fails_the_batch_without_bisecting(tmp_path, monkeypatch):
+    calls = []
+
+    async def create_many(batch, session):
+        calls.append(len(batch))
+        raise OperationalError("INSERT", {}, ConnectionError("connection lost"))
+
+    monkeypatch.setattr(data_crud, "create_many", create_many)
+
+    count, buffer = run_buffer(tmp_path, monkeypatch, [reading(i) for i in range(8)])
+
+    assert count == 0
+    assert calls == [8]
+    assert buffer.metrics["failed_rows"] == 8
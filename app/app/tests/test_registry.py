@@ -0,0 +1,117 @@
+import asyncio
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import iot.routers
+from iot.crud import data_crud, device_crud
+from iot.models import DataCreate, DeviceModel, DeviceUpdate
+from iot.registry import DeviceRegistry
+from iot.routers import delete_device
+
+
+def test_registry_caches_devices_and_their_cells():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            session.add(
+                DeviceModel(
+                    device_mac="aa", description="a", latitude=6.25, longitude=-75.56
+                )
+            )
+            await session.commit()
+            registry = DeviceRegistry(refresh_seconds=0)
+            await registry.load(session)
+            loaded_cell = registry.cell_of("aa")
+
+            # Created by another worker after the load
+            device = DeviceModel(device_mac="bb", description="b")
+            session.add(device)
+            await session.commit()
+            without_session = await registry.get_by_mac("bb")
+            with_session = await registry.get_by_mac("bb", session)
+            missing = await registry.missing(["aa", "bb", "cc"], session)
+
+            # A partial update keeps the location it does not mention
+            await device_crud.update(
+                device.id,
+                DeviceUpdate(
+                    device_mac="bb", description="b", latitude=4.71, longitude=-74.07
+                ),
+                session,
+            )
+            renamed = await device_crud.update(
+                device.id, DeviceUpdate(device_mac="bb", description="renamed"), session
+            )
+            registry.add(renamed)
+            moved_cell = registry.cell_of("bb")
+            registry.remove("bb")
+        await engine.dispose()
+        return registry, {
+            "loaded_cell": loaded_cell,
+            "without_session": without_session,
+            "with_session": with_session,
+            "missing": missing,
+            "renamed": renamed,
+            "moved_cell": moved_cell,
+        }
+
+    registry, seen = asyncio.run(run())
+
+    assert seen["loaded_cell"] == "d3478"
+    assert seen["without_session"] is None
+    assert seen["with_session"].description == "b"
+    assert seen["missing"] == {"cc"}
+    renamed = seen["renamed"]
+    assert (renamed.latitude, renamed.longitude) == (4.71, -74.07)
+    assert renamed.description == "renamed"
+    assert seen["moved_cell"] == "d2g6f"
+    assert "bb" not in registry.devices
+    assert registry.cell_of("bb") is None
+
+
+def test_device_with_readings_is_not_deleted(monkeypatch):
+    registry = DeviceRegistry(refresh_seconds=0)
+    monkeypatch.setattr(iot.routers, "device_registry", registry)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            used = DeviceModel(device_mac="aa", description="a")
+            unused = DeviceModel(device_mac="bb", description="b")
+            session.add_all([used, unused])
+            await session.commit()
+            await registry.load(session)
+            await data_crud.create_many(
+                [
+                    DataCreate(
+                        temperature=20,
+                        humidity_1=50,
+                        humidity_2=60,
+                        valve_status="ON",
+                        device_mac="aa",
+                    )
+                ],
+                session,
+            )
+            try:
+                await delete_device(used.id, session)
+                status = 200
+            except HTTPException as e:
+                status = e.status_code
+            await delete_device(unused.id, session)
+            remaining = await device_crud.get_many_by_mac(["aa", "bb"], session)
+        await engine.dispose()
+        return status, [device.device_mac for device in remaining]
+
+    status, remaining = asyncio.run(run())
+
+    assert status == 409
+    assert remaining == ["aa"]
+    assert set(registry.devices) == {"aa"}
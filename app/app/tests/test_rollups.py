@@ -0,0 +1,136 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.utils.data_time_zone import DateTimeColombia
+from iot.crud import data_crud
+from iot.models import (
+    DataCreate,
+    DataModel,
+    DataRollupDayModel,
+    DataRollupHourModel,
+    DeviceModel,
+)
+from iot.rollups import ValveClock, apply_readings, rebuild_day, rebuild_days
+
+DAY = date(2024, 1, 1)
+
+
+def readings() -> list[dict]:
+    """
+    Two devices over two hours of DAY, the valve of the first one is ON for
+    2 + 2 minutes at 10:00 and for 3 minutes at 11:00.
+    """
+    start = DateTimeColombia.localize(datetime(2024, 1, 1, 10))
+    rows = []
+    for device_mac, minutes, valve_status, temperature in [
+        ("aa", 0, "ON", 20),
+        ("aa", 2, "ON", 22),
+        ("aa", 4, "OFF", 24),
+        ("aa", 60, "ON", 26),
+        ("aa", 63, "OFF", 28),
+        # Longer than ROLLUP_VALVE_MAX_GAP_SECONDS, counts 300 seconds
+        ("bb", 5, "ON", 10),
+        ("bb", 50, "OFF", 12),
+    ]:
+        created_at = start + timedelta(minutes=minutes)
+        rows.append(
+            {
+                "created_at": created_at,
+                "updated_at": created_at,
+                "created_date": DAY,
+                "device_mac": device_mac,
+                "temperature": temperature,
+                "humidity_1": 50,
+                "humidity_2": 60,
+                "valve_status": valve_status,
+            }
+        )
+    return rows
+
+
+def reading(temperature) -> DataCreate:
+    return DataCreate(
+        temperature=temperature,
+        humidity_1=50,
+        humidity_2=60,
+        valve_status="OFF",
+        device_mac="aa",
+    )
+
+
+async def stored_rollups(conn) -> tuple[list, list]:
+    hours = await conn.execute(
+        select(DataRollupHourModel).order_by(
+            DataRollupHourModel.device_mac, DataRollupHourModel.bucket_start
+        )
+    )
+    days = await conn.execute(
+        select(DataRollupDayModel).order_by(DataRollupDayModel.device_mac)
+    )
+    return [dict(row._mapping) for row in hours], [dict(row._mapping) for row in days]
+
+
+def test_rollups_survive_compaction():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+            rows = readings()
+            await conn.execute(insert(DataModel), rows)
+            await apply_readings(rows, conn, clock=ValveClock(max_gap_seconds=300))
+            incremental = await stored_rollups(conn)
+
+            # What the partition maintenance does before dropping a day
+            await rebuild_day(conn, DAY)
+            rebuilt = await stored_rollups(conn)
+            await conn.execute(delete(DataModel))
+            rebuilt_days = await rebuild_days(conn, DAY, DAY)
+            compacted = await stored_rollups(conn)
+        await engine.dispose()
+        return incremental, rebuilt, rebuilt_days, compacted
+
+    incremental, rebuilt, rebuilt_days, compacted = asyncio.run(run())
+
+    assert rebuilt == incremental
+    assert rebuilt_days == []
+    assert compacted == incremental
+    hours, days = compacted
+    assert [(hour["device_mac"], hour["count"]) for hour in hours] == [
+        ("aa", 3),
+        ("aa", 2),
+        ("bb", 2),
+    ]
+    assert [hour["valve_on_seconds"] for hour in hours] == [240, 180, 300]
+    day = days[0]
+    assert (day["device_mac"], day["count"], day["valve_on_count"]) == ("aa", 5, 3)
+    assert day["temperature_sum"] == 120
+    assert (day["temperature_min"], day["temperature_max"]) == (20, 28)
+
+
+def test_updated_and_deleted_readings_leave_the_rollups():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            session.add(DeviceModel(device_mac="aa", description="a"))
+            await session.commit()
+            first, second = await data_crud.create_many(
+                [reading(20), reading(30)], session
+            )
+            await data_crud.update(first["id"], reading(26), session)
+            await data_crud.delete(second["id"], session)
+            async with engine.connect() as conn:
+                hours, days = await stored_rollups(conn)
+        await engine.dispose()
+        return hours, days
+
+    hours, days = asyncio.run(run())
+
+    assert [(hour["count"], hour["temperature_sum"]) for hour in hours] == [(1, 26)]
+    assert [(day["count"], day["temperature_max"]) for day in days] == [(1, 26)]
@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import iot.setpoint_cache
+from iot.broadcast import MemoryBroadcast
+from iot.models import SetpointModel
+from iot.setpoint_cache import SetpointCache
+
+CREATED_AT = datetime(2024, 1, 1, 8)
+
+
+class SharedBroadcast:
+    """
+    Backend shared by the caches of several workers in one process.
+    """
+
+    local = False
+    max_message_bytes = None
+
+    def __init__(self):
+        self.delivers = []
+
+    def attach(self, deliver, resync=None):
+        self.delivers.append(deliver)
+
+    async def publish(self, device_mac, message):
+        for deliver in self.delivers:
+            deliver(device_mac, message)
+
+
+class FakeDatabase:
+    def __init__(self, setpoint):
+        self.setpoint = setpoint
+        self.reads = 0
+
+    async def get_last_setpoint(self, device_mac, session):
+        self.reads += 1
+        return self.setpoint
+
+
+def setpoint(id, value):
+    return SetpointModel(
+        id=id,
+        device_mac="aa",
+        setpoint=value,
+        created_at=CREATED_AT + timedelta(minutes=id),
+        updated_at=CREATED_AT + timedelta(minutes=id),
+    )
+
+
+def test_polls_are_served_from_memory_until_a_new_setpoint(monkeypatch):
+    database = FakeDatabase(setpoint(1, 40))
+    monkeypatch.setattr(
+        iot.setpoint_cache.device_crud, "get_last_setpoint", database.get_last_setpoint
+    )
+    cache = SetpointCache(MemoryBroadcast(), ttl_seconds=60)
+
+    async def run():
+        first = await cache.get_versioned("aa", None)
+        again = await cache.get_versioned("aa", None)
+        database.setpoint = setpoint(2, 45)
+        created = await cache.set("aa", database.setpoint)
+        after_create = await cache.get_versioned("aa", None)
+        await cache.invalidate("aa")
+        after_invalidate = await cache.get_versioned("aa", None)
+        return first, again, created, after_create, after_invalidate
+
+    first, again, created, after_create, after_invalidate = asyncio.run(run())
+
+    assert first == again
+    assert created.setpoint == 45
+    assert after_create[0] == created
+    assert after_create[1] != first[1]
+    assert after_invalidate == after_create
+    # The first poll and the one after the invalidation
+    assert database.reads == 2
+
+
+def test_new_setpoint_drops_the_entry_of_other_workers(monkeypatch):
+    database = FakeDatabase(setpoint(1, 40))
+    monkeypatch.setattr(
+        iot.setpoint_cache.device_crud, "get_last_setpoint", database.get_last_setpoint
+    )
+    backend = SharedBroadcast()
+    # Entries are kept past the TTL with a shared backend
+    worker_a = SetpointCache(backend, ttl_seconds=0)
+    worker_b = SetpointCache(backend, ttl_seconds=0)
+
+    async def run():
+        await worker_a.get_versioned("aa", None)
+        await worker_b.get_versioned("aa", None)
+        await worker_b.get_versioned("aa", None)
+        database.setpoint = setpoint(2, 45)
+        await worker_a.set("aa", database.setpoint)
+        return await worker_b.get_versioned("aa", None)
+
+    snapshot, _ = asyncio.run(run())
+
+    assert "aa" in worker_a.setpoints
+    assert snapshot.setpoint == 45
+    # Both first polls and worker_b after the change
+    assert database.reads == 3
+
+
+def test_entries_expire_with_a_local_backend(monkeypatch):
+    database = FakeDatabase(setpoint(1, 40))
+    monkeypatch.setattr(
+        iot.setpoint_cache.device_crud, "get_last_setpoint", database.get_last_setpoint
+    )
+    cache = SetpointCache(MemoryBroadcast(), ttl_seconds=0)
+
+    async def run():
+        await cache.get_versioned("aa", None)
+        # Changed by another worker, the memory backend does not tell us
+        database.setpoint = setpoint(2, 45)
+        return await cache.get_versioned("aa", None)
+
+    snapshot, _ = asyncio.run(run())
+
+    assert snapshot.setpoint == 45
+    assert database.reads == 2
@@ -0,0 +1,40 @@
+import numpy as np
+
+from app.utils.time_bucket import TimeBucket, aggregate_buckets
+
+
+def test_aggregate_buckets():
+    timestamps = np.array(
+        [
+            "2024-01-01T10:00:10",
+            "2024-01-01T10:00:50",
+            "2024-01-01T10:01:30",
+            "2024-01-01T10:07:00",
+        ],
+        dtype="datetime64[s]",
+    )
+    values = np.array([1.0, 3.0, 5.0, 7.0])
+
+    starts, counts, stats = aggregate_buckets(
+        timestamps, TimeBucket.ONE_MINUTE.seconds, {"temperature": values}
+    )
+
+    assert starts.tolist() == list(
+        np.array(
+            ["2024-01-01T10:00:00", "2024-01-01T10:01:00", "2024-01-01T10:07:00"],
+            dtype="datetime64[s]",
+        )
+    )
+    assert counts.tolist() == [2, 1, 1]
+    assert stats["temperature"]["min"].tolist() == [1.0, 5.0, 7.0]
+    assert stats["temperature"]["max"].tolist() == [3.0, 5.0, 7.0]
+    assert stats["temperature"]["avg"].tolist() == [2.0, 5.0, 7.0]
+
+
+def test_aggregate_buckets_empty():
+    starts, counts, _ = aggregate_buckets(
+        np.array([], dtype="datetime64[s]"), TimeBucket.ONE_HOUR.seconds, {}
+    )
+
+    assert starts.size == 0
+    assert counts.size == 0
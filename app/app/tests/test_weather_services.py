@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+
+from weather.models import LocationParams
+from weather.services.cache import WeatherCache
+from weather.services.external_api import CircuitBreaker, OpenWeatherClient
+
+WEATHER = {"name": "Medellin", "main": {"temp": 24.5}}
+
+
+def make_client(handler, failure_threshold=5):
+    return OpenWeatherClient(
+        base_url="http://openweather.test/data/2.5/weather",
+        api_key="key",
+        timeout=httpx.Timeout(1),
+        max_retries=2,
+        backoff=0,
+        breaker=CircuitBreaker(failure_threshold, reset_timeout=60),
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def test_retries_server_errors_then_succeeds():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return httpx.Response(503)
+        return httpx.Response(200, json=WEATHER)
+
+    client = make_client(handler)
+    assert asyncio.run(client.get({"q": "Medellin"})) == WEATHER
+    assert len(calls) == 3
+    assert calls[0].url.params["appid"] == "key"
+
+
+def test_city_not_found_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(404, json={"cod": "404", "message": "city not found"})
+
+    client = make_client(handler)
+    assert asyncio.run(client.get({"q": "Nowhere"}))["cod"] == "404"
+    assert len(calls) == 1
+
+
+def test_circuit_opens_and_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("connection refused")
+
+    client = make_client(handler, failure_threshold=2)
+    for _ in range(3):
+        assert asyncio.run(client.get({"q": "Medellin"})) is None
+    # Two failed calls of three attempts each, the third call is rejected
+    assert len(calls) == 6
+    assert client.breaker.is_open
+
+
+def make_cache(now):
+    calls = []
+
+    async def fetch(city_name, country_code=None, state_code=None):
+        calls.append(city_name)
+        await asyncio.sleep(0.01)
+        return {"name": city_name, "call": len(calls)}
+
+    cache = WeatherCache(
+        fetch, ttl_seconds=60, stale_seconds=300, max_entries=10, clock=lambda: now[0]
+    )
+    return cache, calls
+
+
+def test_cache_single_flight():
+    now = [0.0]
+    cache, calls = make_cache(now)
+
+    async def scenario():
+        results = await asyncio.gather(
+            cache.get(LocationParams(city_name="Medellin")),
+            cache.get(LocationParams(city_name=" medellin ")),
+            cache.get(LocationParams(city_name="MEDELLIN")),
+        )
+        return results, await cache.get(LocationParams(city_name="Medellin"))
+
+    results, cached = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(result["call"] == 1 for result in results)
+    assert cached["call"] == 1
+
+
+def test_cache_stale_while_revalidate():
+    now = [0.0]
+    cache, calls = make_cache(now)
+    location = LocationParams(city_name="Medellin")
+
+    async def scenario():
+        first = await cache.get(location)
+        now[0] = 100.0
+        stale = await cache.get(location)
+        await asyncio.sleep(0.05)
+        refreshed = await cache.get(location)
+        now[0] = 1_000.0
+        expired = await cache.get(location)
+        return first, stale, refreshed, expired
+
+    first, stale, refreshed, expired = asyncio.run(scenario())
+    assert [first["call"], stale["call"], refreshed["call"]] == [1, 1, 2]
+    assert expired["call"] == 3
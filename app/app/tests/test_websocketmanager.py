@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+from iot.broadcast import MemoryBroadcast
+from iot.websocketmanager import ALL_DEVICES, ConnectionManager, SlowConsumerPolicy
+
+
+class FakeWebSocket:
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.closed = False
+        self.blocked = blocked
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.blocked:
+            await asyncio.Event().wait()
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def make_manager(
+    policy=SlowConsumerPolicy.DROP_OLDEST, queue_size: int = 10
+) -> ConnectionManager:
+    return ConnectionManager(
+        queue_size=queue_size,
+        slow_consumer_policy=policy,
+        send_timeout=1,
+        backend=MemoryBroadcast(),
+    )
+
+
+def test_rows_are_grouped_per_device_and_fanned_out():
+    manager = make_manager()
+    device_socket, all_socket = FakeWebSocket(), FakeWebSocket()
+    rows = [
+        {"device_mac": "aa", "temperature": 20.0},
+        {"device_mac": "bb", "temperature": 21.0},
+        {"device_mac": "aa", "temperature": 22.0},
+        {"device_mac": "cc", "temperature": 23.0},
+    ]
+
+    async def run():
+        device_subscriber = await manager.connect(device_socket, "aa")
+        all_subscriber = await manager.accept(all_socket)
+        manager.subscribe(all_subscriber, [ALL_DEVICES])
+        await manager.send_grouped(rows)
+        await asyncio.sleep(0.05)
+        manager.remove(device_subscriber)
+        manager.remove(all_subscriber)
+
+    asyncio.run(run())
+
+    # One object per row on the per-device socket, lists on /data/ws
+    assert [json.loads(message) for message in device_socket.sent] == [
+        rows[0],
+        rows[2],
+    ]
+    assert sorted(
+        row["temperature"] for message in all_socket.sent for row in json.loads(message)
+    ) == [20.0, 21.0, 22.0, 23.0]
+    assert manager.active_connections == {}
+
+
+def test_slow_consumer_policies():
+    async def run(policy):
+        manager = make_manager(policy, queue_size=2)
+        websocket = FakeWebSocket(blocked=True)
+        subscriber = await manager.accept(websocket)
+        manager.subscribe(subscriber, ["aa"])
+        # The writer takes the first message and blocks on it
+        await manager.send_data("0", "aa")
+        await asyncio.sleep(0.01)
+        for i in range(1, 6):
+            await manager.send_data(str(i), "aa")
+        await asyncio.sleep(0.01)
+        queued = list(subscriber.queue._queue)
+        manager.remove(subscriber)
+        return manager, subscriber, websocket, queued
+
+    manager, subscriber, websocket, queued = asyncio.run(
+        run(SlowConsumerPolicy.DROP_OLDEST)
+    )
+    assert queued == ["4", "5"]
+    assert subscriber.dropped == 3
+
+    manager, subscriber, websocket, queued = asyncio.run(
+        run(SlowConsumerPolicy.DISCONNECT)
+    )
+    assert "aa" not in manager.active_connections
+    assert websocket.closed
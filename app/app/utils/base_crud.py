@@ -1,78 +1,153 @@
-from datetime import date
-from typing import List, Type
+from typing import AsyncIterator, List
 
-from sqlmodel import Session, SQLModel, func, select
+from sqlmodel import SQLModel, func, insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.core.config import settings
+from app.utils.data_time_zone import DateTimeColombia
+from app.utils.pagination import keyset_before, keyset_order
+
+
+class AsyncBaseCRUD:
+    """
+    Generic CRUD over an AsyncSession (asyncpg), the routers' only session.
+    """
 
-class BaseCRUD:
     def __init__(self):
         self.model: SQLModel
 
-    def create(self, obj: SQLModel, session: Session):
+    async def create(self, obj: SQLModel, session: AsyncSession):
         db_obj = self.model(**obj.model_dump())
         session.add(db_obj)
-        session.commit()
-        session.refresh(db_obj)
+        await self._on_insert([db_obj.model_dump()], session)
+        await session.commit()
+        await session.refresh(db_obj)
         return db_obj
 
-    def get_all(self, skip, limit, session: Session) -> List[SQLModel]:
-        statement = select(self.model).offset(skip).limit(limit)
-        result = session.exec(statement)
-        result = result.all()
-        return [obj_db for obj_db in result]
+    async def create_many(self, objs: list, session: AsyncSession) -> list:
+        """
+        Inserts many rows with a single multi-row INSERT ... RETURNING, the
+        returned rows are in the order of `objs`.
+
+        The timestamps are computed once for the whole batch and no ORM
+        objects are instantiated, the inserted rows are returned as dicts.
+        """
+        if not objs:
+            return []
+        now = DateTimeColombia.now()
+        today = now.date()
+        rows = [
+            {
+                **obj.model_dump(),
+                "created_at": now,
+                "updated_at": now,
+                "created_date": today,
+            }
+            for obj in objs
+        ]
+        table = self.model.__table__
+        statement = insert(table).returning(*table.c, sort_by_parameter_order=True)
+        result = await session.execute(statement, rows)
+        inserted = [dict(row._mapping) for row in result]
+        await self._on_insert(rows, session)
+        await session.commit()
+        return inserted
 
-    def get_by_id(self, id, session: Session) :
-        statement = select(self.model).where(self.model.id == id)
-        result = session.exec(statement)
-        obj = result.first()
-        return obj
+    async def _on_insert(self, rows: List[dict], session: AsyncSession):
+        """
+        Called with the new rows before create/create_many commit, subclasses
+        use it to keep derived tables in the same transaction.
+        """
+
+    async def _on_change(self, rows: List[dict], session: AsyncSession):
+        """
+        Called before update/delete commit with the stored rows they touched,
+        as they were before and after an update.
+        """
+
+    async def get_all(self, skip, limit, session: AsyncSession) -> List[SQLModel]:
+        """
+        Offset page in the same (created_at DESC, id DESC) order as get_page.
+        """
+        statement = (
+            select(self.model)
+            .order_by(*keyset_order(self.model))
+            .offset(skip)
+            .limit(limit)
+        )
+        result = await session.exec(statement)
+        return result.all()
+
+    async def get_page(
+        self, cursor, limit, session: AsyncSession, *filters
+    ) -> List[SQLModel]:
+        """
+        Keyset page in (created_at DESC, id DESC) order, `cursor` is the
+        next_cursor of the previous page or None for the first one.
+        """
+        statement = select(self.model).where(*filters)
+        if cursor:
+            statement = statement.where(keyset_before(self.model, cursor))
+        statement = statement.order_by(*keyset_order(self.model)).limit(limit)
+        result = await session.exec(statement)
+        return result.all()
+
+    async def stream(
+        self,
+        session: AsyncSession,
+        *filters,
+        batch_size: int = settings.STREAM_BATCH_SIZE,
+    ) -> AsyncIterator[List[dict]]:
+        """
+        Yields the matching rows in (created_at, id) order, in batches of
+        dicts fetched from a server-side cursor without building ORM objects.
+        """
+        statement = (
+            select(*self.model.__table__.c)
+            .where(*filters)
+            .order_by(self.model.created_at, self.model.id)
+            .execution_options(yield_per=batch_size)
+        )
+        result = await session.stream(statement)
+        async for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
 
-    def update(self, id, obj_data, session: Session):
-        obj_data = obj_data.model_dump()
+    async def get_by_id(self, id, session: AsyncSession):
         statement = select(self.model).where(self.model.id == id)
-        result = session.exec(statement)
-        db_obj = result.first()
+        result = await session.exec(statement)
+        return result.first()
+
+    async def update(self, id, obj_data, session: AsyncSession):
+        # Fields the client did not send keep their stored value
+        obj_data = obj_data.model_dump(exclude_unset=True)
+        db_obj = await self.get_by_id(id, session)
+        if db_obj is None:
+            return None
+        before = db_obj.model_dump()
         for key, value in obj_data.items():
             setattr(db_obj, key, value)
-        session.commit()
-        session.refresh(db_obj)
+        if hasattr(db_obj, "updated_at"):
+            db_obj.updated_at = DateTimeColombia.now()
+        await self._on_change([before, db_obj.model_dump()], session)
+        await session.commit()
+        await session.refresh(db_obj)
         return db_obj
 
-    def delete(self, id, session: Session):
-        statement = select(self.model).where(self.model.id == id)
-        result = session.exec(statement)
-        db_obj = result.first()
-        session.delete(db_obj)
-        session.commit()
+    async def delete(self, id, session: AsyncSession):
+        db_obj = await self.get_by_id(id, session)
+        if db_obj is None:
+            return None
+        await session.delete(db_obj)
+        await self._on_change([db_obj.model_dump()], session)
+        await session.commit()
         return db_obj
 
-    def count(self, session: Session) -> int:
+    async def count(self, session: AsyncSession) -> int:
         statement = select(func.count()).select_from(self.model)
-        result = session.exec(statement)
-        count = result.first()
-        return count
-
-    def filter_by(self, filters: dict, session: Session) -> List[SQLModel]:
-        statement = select(self.model).where(**filters)
-        result = session.exec(statement)
-        result = result.all()
-        return [obj_db for obj_db in result]
-
-    @staticmethod
-    def filter_data_by_date_and_attribute(
-        session: Session, model: Type, date_value: date, **attributes
-    ) -> List:
-        """
-        Filtra los datos en la base de datos por una fecha y otros atributos específicos.
+        result = await session.exec(statement)
+        return result.first()
 
-        :param session: Instancia de la sesión de SQLAlchemy.
-        :param model: Clase del modelo SQLAlchemy.
-        :param date_value: Fecha específica para filtrar los datos.
-        :param attributes: Diccionario de atributos adicionales para filtrar.
-        :return: Lista de objetos filtrados por la fecha y los atributos especificados.
-        """
-        query = session.query(model).filter(model.created_date == date_value)
-        for attr, value in attributes.items():
-            query = query.filter(getattr(model, attr) == value)
-        result = query.all()
-        return result
+    async def filter_by(self, filters: dict, session: AsyncSession) -> List[SQLModel]:
+        statement = select(self.model).filter_by(**filters)
+        result = await session.exec(statement)
+        return result.all()
@@ -14,6 +14,15 @@ class DateTimeColombia:
     def today():
         return datetime.now(DateTimeColombia.BOGOTA_TZ).date()
 
+    @staticmethod
+    def localize(value: datetime):
+        """
+        Returns `value` in Bogota time, naive datetimes are taken as Bogota time.
+        """
+        if value.tzinfo is None:
+            return DateTimeColombia.BOGOTA_TZ.localize(value)
+        return value.astimezone(DateTimeColombia.BOGOTA_TZ)
+
 
 if __name__ == "__main__":
     print(DateTimeColombia.now())
@@ -0,0 +1,60 @@
+from typing import Dict
+
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points of the
+    series that keep its visual shape, spikes included.
+
+    The first and last points are kept. The points in between are split in
+    threshold - 2 buckets and each bucket keeps the point forming the largest
+    triangle with the point kept in the previous bucket and the mean of the
+    next bucket.
+
+    Args:
+        x (np.ndarray): Ascending x values, e.g. epoch seconds.
+        y (np.ndarray): Values aligned with `x`.
+        threshold (int): Number of points to keep, at least 3.
+
+    Returns:
+        np.ndarray: Ascending indices into `x` and `y`.
+    """
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket i holds the points edges[i]:edges[i + 1], the last point alone
+    # closes the series
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(np.r_[edges, size])
+    mean_x = np.add.reduceat(x, edges) / counts
+    mean_y = np.add.reduceat(y, edges) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, size - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[previous] - mean_x[i + 1]) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (mean_y[i + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample_indices(
+    x: np.ndarray, series: Dict[str, np.ndarray], max_points: int
+) -> np.ndarray:
+    """
+    Indices of at most `max_points` rows keeping the shape of every series,
+    the union of an LTTB of each series with an equal share of the points.
+    """
+    if len(x) <= max_points:
+        return np.arange(len(x))
+    threshold = max_points // len(series)
+    return np.unique(np.concatenate([lttb(x, y, threshold) for y in series.values()]))
@@ -0,0 +1,166 @@
+import io
+from enum import Enum
+from typing import AsyncIterator, List
+
+import pandas as pd
+from pydantic_core import to_json
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric
+
+from app.utils.data_time_zone import DateTimeColombia
+
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    ARROW = "arrow"
+    PARQUET = "parquet"
+
+    @property
+    def media_type(self) -> str:
+        return {
+            "csv": "text/csv",
+            "ndjson": "application/x-ndjson",
+            "arrow": "application/vnd.apache.arrow.stream",
+            "parquet": "application/vnd.apache.parquet",
+        }[self.value]
+
+    @property
+    def requires_pyarrow(self) -> bool:
+        return self in (ExportFormat.ARROW, ExportFormat.PARQUET)
+
+
+def pyarrow_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def arrow_schema(model):
+    """
+    Arrow schema of the columns of a table model, so every batch is written
+    with the same types whatever values the first one holds.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for column in model.__table__.columns:
+        if isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, (Float, Numeric)):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us", tz="UTC" if column.type.timezone else None)
+        elif isinstance(column.type, Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable))
+    return pa.schema(fields)
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file that keeps what pyarrow writes until it is drained.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class BatchEncoder:
+    """
+    Encodes batches of rows (dicts) into one export file, column batch by
+    column batch. Call encode() per batch and close() once at the end, both
+    return the bytes ready to be sent. The rows hold the columns of `model`.
+    """
+
+    def __init__(self, export_format: ExportFormat, model):
+        self.export_format = export_format
+        self.model = model
+        self.sink = _ChunkSink()
+        self.writer = None
+        self.first = True
+
+    def encode(self, rows: List[dict]) -> bytes:
+        if not rows:
+            return b""
+        if self.export_format == ExportFormat.NDJSON:
+            data = b"".join(to_json(row) + b"\n" for row in rows)
+        elif self.export_format == ExportFormat.CSV:
+            data = self._frame(rows).to_csv(index=False, header=self.first).encode()
+        else:
+            self._write_arrow(self._frame(rows))
+            data = self.sink.drain()
+        self.first = False
+        return data
+
+    def close(self) -> bytes:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return self.sink.drain()
+
+    def _write_arrow(self, frame: pd.DataFrame):
+        import pyarrow as pa
+
+        schema = arrow_schema(self.model)
+        if self.writer is None:
+            if self.export_format == ExportFormat.PARQUET:
+                import pyarrow.parquet as pq
+
+                self.writer = pq.ParquetWriter(self.sink, schema)
+            else:
+                self.writer = pa.ipc.new_stream(self.sink, schema)
+        frame = frame.reindex(columns=schema.names)
+        for field in schema:
+            column = frame[field.name]
+            if field.type.equals(pa.timestamp("us", tz="UTC")) and (
+                pd.api.types.is_datetime64_dtype(column)
+            ):
+                # Naive values are Bogota wall time
+                frame[field.name] = column.dt.tz_localize(DateTimeColombia.BOGOTA_TZ)
+        self.writer.write_table(
+            pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+        )
+
+    @staticmethod
+    def _frame(rows: List[dict]) -> pd.DataFrame:
+        frame = pd.DataFrame.from_records(rows)
+        for column in frame.columns:
+            if isinstance(frame[column].iloc[0], Enum):
+                frame[column] = frame[column].map(lambda value: value.value)
+        return frame
+
+
+async def export_stream(
+    batches: AsyncIterator[List[dict]], export_format: ExportFormat, model
+) -> AsyncIterator[bytes]:
+    encoder = BatchEncoder(export_format, model)
+    async for rows in batches:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    data = encoder.close()
+    if data:
+        yield data
@@ -0,0 +1,52 @@
+import io
+
+import pandas as pd
+from sqlalchemy import Float, cast, extract
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.utils.data_time_zone import DateTimeColombia
+
+
+def epoch_column(column, name: str = "created_at"):
+    """
+    `column` in epoch seconds, to be read into a float array.
+    """
+    return cast(extract("epoch", column), Float).label(name)
+
+
+async def copy_frame(statement, session: AsyncSession) -> pd.DataFrame:
+    """
+    Rows of `statement` through a Postgres COPY to CSV, parsed by pandas in
+    one pass instead of building a Python object per value.
+    """
+    compiled = statement.compile(dialect=session.get_bind().dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    buffer = io.BytesIO()
+    await raw_connection.driver_connection.copy_from_query(
+        str(compiled), *params, output=buffer, format="csv", header=True
+    )
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+
+async def load_frame(statement, session: AsyncSession) -> pd.DataFrame:
+    """
+    Rows of `statement`, whose created_at is in epoch seconds (see
+    epoch_column), as a DataFrame of column arrays with a UTC created_at.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        frame = await copy_frame(statement, session)
+        frame["created_at"] = pd.to_datetime(frame["created_at"], unit="s", utc=True)
+        return frame
+    result = await session.execute(statement)
+    frame = pd.DataFrame(result.all(), columns=list(result.keys()))
+    # Databases without time zones store naive Bogota wall time, which their
+    # epoch extraction reads as UTC
+    frame["created_at"] = (
+        pd.to_datetime(frame["created_at"], unit="s")
+        .dt.tz_localize(DateTimeColombia.BOGOTA_TZ)
+        .dt.tz_convert("UTC")
+    )
+    return frame
@@ -0,0 +1,67 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+from app.utils.data_time_zone import DateTimeColombia
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """
+    Opaque keyset cursor for the (created_at, id) position of a row.
+    """
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return DateTimeColombia.localize(datetime.fromisoformat(created_at)), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_before(model, cursor: str):
+    """
+    Condition for the rows after `cursor` in (created_at DESC, id DESC) order.
+    """
+    created_at, id = decode_cursor(cursor)
+    return tuple_(model.created_at, model.id) < tuple_(created_at, id)
+
+
+def keyset_order(model):
+    return model.created_at.desc(), model.id.desc()
+
+
+def next_cursor(items: Sequence, limit: int) -> Optional[str]:
+    """
+    Cursor of the last item when the page is full, None on the last page.
+    """
+    if not items or len(items) < limit:
+        return None
+    last = items[-1]
+    if isinstance(last, dict):
+        return encode_cursor(last["created_at"], last["id"])
+    return encode_cursor(last.created_at, last.id)
+
+
+def columns_next_cursor(columns: dict, limit: int) -> Optional[str]:
+    """
+    next_cursor for a columnar page ({"id": [...], "created_at": [...], ...}).
+    """
+    if not columns["id"] or len(columns["id"]) < limit:
+        return None
+    return encode_cursor(columns["created_at"][-1], columns["id"][-1])
+
+
+def set_next_cursor(response: Response, items: Sequence, limit: int):
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,47 @@
+from enum import Enum
+from typing import AsyncIterator, List
+
+from pydantic_core import to_json
+
+
+class StreamFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+
+    @property
+    def media_type(self) -> str:
+        return {"json": "application/json", "ndjson": "application/x-ndjson"}[
+            self.value
+        ]
+
+
+async def json_array_stream(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """
+    Encodes batches of rows as one JSON array, one chunk per batch.
+    """
+    yield b"["
+    first = True
+    async for rows in batches:
+        if not rows:
+            continue
+        chunk = to_json(rows)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+
+async def ndjson_stream(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """
+    Encodes batches of rows as newline delimited JSON, one chunk per batch.
+    """
+    async for rows in batches:
+        if rows:
+            yield b"".join(to_json(row) + b"\n" for row in rows)
+
+
+def encode_stream(
+    batches: AsyncIterator[List[dict]], stream_format: StreamFormat
+) -> AsyncIterator[bytes]:
+    if stream_format == StreamFormat.NDJSON:
+        return ndjson_stream(batches)
+    return json_array_stream(batches)
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, literal, literal_column
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.utils.data_time_zone import DateTimeColombia
+
+# Origin for date_bin, midnight in Bogota so 1d buckets are local days and
+# 1m/5m/1h buckets are still round
+BUCKET_ORIGIN = datetime(2000, 1, 1, tzinfo=timezone(timedelta(hours=-5)))
+
+
+class TimeBucket(str, Enum):
+    ONE_MINUTE = "1m"
+    FIVE_MINUTES = "5m"
+    ONE_HOUR = "1h"
+    ONE_DAY = "1d"
+
+    @property
+    def seconds(self) -> int:
+        return {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}[self.value]
+
+
+def bucket_expression(column, bucket: TimeBucket):
+    """
+    SQL expression with the start of the bucket of `column` (Postgres date_bin).
+    """
+    return func.date_bin(
+        literal(timedelta(seconds=bucket.seconds)), column, BUCKET_ORIGIN
+    )
+
+
+def aggregate_buckets(
+    timestamps: np.ndarray, seconds: int, columns: Dict[str, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, Dict[str, np.ndarray]]]:
+    """
+    Vectorized fallback of GROUP BY bucket for databases without date_bin.
+
+    Args:
+        timestamps (np.ndarray): datetime64 values, sorted ascending.
+        seconds (int): Size of the bucket in seconds.
+        columns (dict): Name -> float array aligned with `timestamps`.
+
+    Returns:
+        tuple: (bucket starts as datetime64[s], counts, {name: {min, max, avg}})
+    """
+    epoch = timestamps.astype("datetime64[s]").astype(np.int64)
+    buckets = epoch - epoch % seconds
+    if buckets.size == 0:
+        return buckets.astype("datetime64[s]"), buckets, {name: {} for name in columns}
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.diff(np.r_[starts, buckets.size])
+    stats = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=float)
+        stats[name] = {
+            "min": np.minimum.reduceat(values, starts),
+            "max": np.maximum.reduceat(values, starts),
+            "avg": np.add.reduceat(values, starts) / counts,
+        }
+    return buckets[starts].astype("datetime64[s]"), counts, stats
+
+
+async def aggregate_by_bucket(
+    session: AsyncSession,
+    timestamp,
+    filters: list,
+    bucket: TimeBucket,
+    series: Dict[str, object],
+    means: Optional[Dict[str, object]] = None,
+) -> list[dict]:
+    """
+    Rows per time bucket of `timestamp` with the count, the min/max/avg of
+    each series and the avg of each mean.
+
+    The grouping runs in Postgres (date_bin), other databases fall back to a
+    vectorized NumPy aggregation (aggregate_buckets) over the queried columns.
+
+    Args:
+        session (AsyncSession): Database session.
+        timestamp: Column of the readings time.
+        filters (list): WHERE clauses of the readings.
+        bucket (TimeBucket): Size of the buckets.
+        series (dict): Name -> column, gives {name}_min, {name}_max, {name}_avg.
+        means (dict): Name -> expression, gives its avg as {name}.
+
+    Returns:
+        list: One dict per bucket, ascending by bucket_start.
+    """
+    means = means or {}
+    if session.get_bind().dialect.name != "postgresql":
+        return await _aggregate_numpy(
+            session, timestamp, filters, bucket, series, means
+        )
+
+    bucket_start = bucket_expression(timestamp, bucket).label("bucket_start")
+    columns = [bucket_start, func.count().label("count")]
+    for name, column in series.items():
+        columns += [
+            func.min(column).label(f"{name}_min"),
+            func.max(column).label(f"{name}_max"),
+            func.avg(column).label(f"{name}_avg"),
+        ]
+    columns += [func.avg(column).label(name) for name, column in means.items()]
+    statement = (
+        select(*columns)
+        .where(*filters)
+        .group_by(literal_column("bucket_start"))
+        .order_by(literal_column("bucket_start"))
+    )
+    result = await session.execute(statement)
+    return [dict(row._mapping) for row in result]
+
+
+async def _aggregate_numpy(
+    session: AsyncSession,
+    timestamp,
+    filters: list,
+    bucket: TimeBucket,
+    series: Dict[str, object],
+    means: Dict[str, object],
+) -> list[dict]:
+    statement = (
+        select(timestamp, *series.values(), *means.values())
+        .where(*filters)
+        .order_by(timestamp)
+    )
+    result = await session.execute(statement)
+    rows = result.all()
+    if not rows:
+        return []
+    created_at, *values = zip(*rows)
+    # Bucketed on Bogota wall time, BUCKET_ORIGIN is a Bogota midnight
+    timestamps = np.array(
+        [DateTimeColombia.localize(value).replace(tzinfo=None) for value in created_at],
+        dtype="datetime64[us]",
+    )
+    starts, counts, stats = aggregate_buckets(
+        timestamps, bucket.seconds, dict(zip([*series, *means], values))
+    )
+    buckets = []
+    for i, bucket_start in enumerate(starts.tolist()):
+        row = {"bucket_start": DateTimeColombia.localize(bucket_start)}
+        row["count"] = int(counts[i])
+        for name in series:
+            for stat in ("min", "max", "avg"):
+                row[f"{name}_{stat}"] = float(stats[name][stat][i])
+        for name in means:
+            row[name] = float(stats[name]["avg"][i])
+        buckets.append(row)
+    return buckets
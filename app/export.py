@@ -0,0 +1,63 @@
+# export.py
+"""
+Exports stored telemetry to a file, streaming it in column batches.
+
+Usage:
+    python export.py data --start 2024-01-01 [--end 2025-01-01]
+        [--device-mac 00:1B:44:11:3A:B7] [--format parquet] [--output data.parquet]
+    python export.py weather --start 2024-01-01 [--city-name Medellin]
+        [--format csv]
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+from iot.crud import data_crud
+from weather.crud import weather_api_crud
+
+from app.db.configDatabase import async_engine, async_session_maker
+from app.utils.data_time_zone import DateTimeColombia
+from app.utils.export import ExportFormat, export_stream
+
+
+async def export(args) -> int:
+    start = DateTimeColombia.localize(args.start)
+    end = DateTimeColombia.localize(args.end) if args.end else DateTimeColombia.now()
+    output = args.output or f"{args.table}_{start:%Y%m%d}_{end:%Y%m%d}.{args.format}"
+
+    written = 0
+    async with async_session_maker() as session:
+        if args.table == "data":
+            crud = data_crud
+            batches = data_crud.stream_range(args.device_mac, start, end, session)
+        else:
+            crud = weather_api_crud
+            batches = weather_api_crud.stream_range(args.city_name, start, end, session)
+        with open(output, "wb") as file:
+            export_format = ExportFormat(args.format)
+            async for chunk in export_stream(batches, export_format, crud.model):
+                file.write(chunk)
+                written += len(chunk)
+    await async_engine.dispose()
+    print(f"{output}: {written} bytes")
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Export stored telemetry")
+    parser.add_argument("table", choices=["data", "weather"])
+    parser.add_argument("--start", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument("--device-mac", help="only this device (data)")
+    parser.add_argument("--city-name", help="only this city (weather)")
+    parser.add_argument(
+        "--format", choices=[f.value for f in ExportFormat], default="csv"
+    )
+    parser.add_argument("--output", help="defaults to <table>_<start>_<end>.<format>")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(export(parse_args(sys.argv[1:]))))
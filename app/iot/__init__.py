@@ -1,7 +1,5 @@
 from fastapi import APIRouter
 
-from app.utils.base_crud import BaseCRUD  # noqa: F401
-
 from .models import DataModel, DeviceModel, SetpointModel  # noqa: F401
 from .routers import data_routes, device_routes, setpoints_routes  # noqa: F401
 
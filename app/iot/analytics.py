@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.utils.frames import epoch_column, load_frame
+from weather.models import SERIES_COLUMNS, WeatherAPIModel
+
+from .crud import DEVICE_SERIES, data_crud
+from .models import SENSOR_COLUMNS, DataModel, ValveStatus
+
+WEATHER_COLUMNS = SERIES_COLUMNS
+
+
+async def load_readings(
+    device_mac: str, start: datetime, end: datetime, session: AsyncSession
+) -> pd.DataFrame:
+    valve_on = case((DataModel.valve_status == ValveStatus.ON, 1.0), else_=0.0)
+    statement = (
+        select(
+            epoch_column(DataModel.created_at),
+            *(getattr(DataModel, name) for name in SENSOR_COLUMNS),
+            valve_on.label("valve_on"),
+        )
+        .where(
+            DataModel.device_mac == device_mac, *data_crud._range_filters(start, end)
+        )
+        .order_by(DataModel.created_at)
+    )
+    return await load_frame(statement, session)
+
+
+async def load_weather(
+    city_name: str, start: datetime, end: datetime, session: AsyncSession
+) -> pd.DataFrame:
+    statement = (
+        select(
+            epoch_column(WeatherAPIModel.created_at),
+            *(getattr(WeatherAPIModel, name) for name in WEATHER_COLUMNS),
+        )
+        .where(
+            WeatherAPIModel.city_name == city_name,
+            WeatherAPIModel.created_at >= start,
+            WeatherAPIModel.created_at < end,
+        )
+        .order_by(WeatherAPIModel.created_at)
+    )
+    return await load_frame(statement, session)
+
+
+def join_asof(
+    readings: pd.DataFrame, weather: pd.DataFrame, tolerance: timedelta
+) -> pd.DataFrame:
+    """
+    Each reading joined to the last weather observation at or before it, no
+    older than `tolerance`. Readings without one are dropped. The weather
+    columns are prefixed with "weather_".
+    """
+    weather = weather.rename(
+        columns={name: f"weather_{name}" for name in WEATHER_COLUMNS}
+    )
+    joined = pd.merge_asof(
+        readings,
+        weather,
+        on="created_at",
+        direction="backward",
+        tolerance=pd.Timedelta(tolerance),
+    )
+    return joined.dropna(subset=[f"weather_{name}" for name in WEATHER_COLUMNS])
+
+
+def _correlation_table(
+    device: pd.DataFrame, weather: pd.DataFrame
+) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Pearson correlation of each device column with each weather column, None
+    where it is undefined (constant column or too few pairs).
+    """
+    table = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for device_name in DEVICE_SERIES:
+            table[device_name] = {}
+            for weather_name in WEATHER_COLUMNS:
+                value = device[device_name].corr(weather[f"weather_{weather_name}"])
+                table[device_name][weather_name] = (
+                    None if np.isnan(value) else round(float(value), 4)
+                )
+    return table
+
+
+def correlate(joined: pd.DataFrame, max_lag_hours: int) -> dict:
+    """
+    Correlations of the joined readings, plus the correlations of the hourly
+    means with the device side lagged 0..max_lag_hours behind the weather.
+    """
+    if joined.empty:
+        return {"matched": 0, "correlations": {}, "lagged": []}
+    correlations = _correlation_table(joined, joined)
+    hourly = joined.set_index("created_at").resample("1h").mean(numeric_only=True)
+    lagged = []
+    for lag in range(max_lag_hours + 1):
+        # Device values `lag` hours later against the weather of each hour
+        device = hourly[list(DEVICE_SERIES)].shift(-lag)
+        lagged.append(
+            {
+                "lag_hours": lag,
+                "hours": int(
+                    (device.notna().all(axis=1) & hourly.notna().all(axis=1)).sum()
+                ),
+                "correlations": _correlation_table(device, hourly),
+            }
+        )
+    return {"matched": len(joined), "correlations": correlations, "lagged": lagged}
+
+
+async def weather_correlation(
+    device_mac: str,
+    city_name: str,
+    start: datetime,
+    end: datetime,
+    tolerance: timedelta,
+    max_lag_hours: int,
+    session: AsyncSession,
+) -> dict:
+    """
+    As-of join of the readings of a device in [start, end) to the weather
+    history of `city_name`, and the correlations between both.
+    """
+    readings = await load_readings(device_mac, start, end, session)
+    # Observations up to `tolerance` before start still match the first readings
+    weather = await load_weather(city_name, start - tolerance, end, session)
+    if readings.empty or weather.empty:
+        return {"matched": 0, "correlations": {}, "lagged": []}
+    return correlate(join_asof(readings, weather, tolerance), max_lag_hours)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List
+
+from sqlalchemy.engine import make_url
+
+from app.core.config import settings
+
+log = logging.getLogger("uvicorn")
+
+# NOTIFY payloads must stay under 8000 bytes
+NOTIFY_MAX_BYTES = 7_900
+# Wait between connection attempts while Postgres is unreachable
+RECONNECT_DELAY_SECONDS = 1
+
+Deliver = Callable[[str, str], None]
+# Called after a reconnect, the notifications sent in between were missed
+Resync = Callable[[], Awaitable[None]]
+
+
+class MemoryBroadcast:
+    """
+    Delivers the messages to the subscribers of this process only.
+    """
+
+    # Messages for devices without local subscribers can be skipped
+    local = True
+    max_message_bytes = None
+
+    def __init__(self):
+        self.deliver: Deliver | None = None
+
+    def attach(self, deliver: Deliver, resync: Resync | None = None):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, device_mac: str, message: str):
+        self.deliver(device_mac, message)
+
+
+class PostgresBroadcast:
+    """
+    Delivers the messages to the subscribers of every worker through
+    Postgres LISTEN/NOTIFY.
+
+    Messages are queued and sent every `flush_interval_ms`, one NOTIFY per
+    device holding as many messages as fit in NOTIFY_MAX_BYTES. The payload
+    is the device mac followed by one message per line, so the JSON is never
+    encoded again. This worker also gets its own notifications, that is how
+    its local subscribers are served.
+
+    Messages published while Postgres is unreachable, or beyond
+    `max_pending` waiting ones, are dropped: they are live updates, not
+    records.
+
+    The LISTEN connection is opened by the background task, so a start
+    while Postgres is down does not fail: the task keeps retrying.
+    """
+
+    local = False
+    max_message_bytes = NOTIFY_MAX_BYTES
+
+    def __init__(
+        self,
+        database_url: str,
+        channel: str,
+        flush_interval_ms: int,
+        max_pending: int,
+    ):
+        self.dsn = (
+            make_url(database_url)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self.channel = channel
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.deliver: Deliver | None = None
+        self.resync: Resync | None = None
+        self.connection = None
+        self.task: asyncio.Task | None = None
+        self._pending: Dict[str, List[str]] = defaultdict(list)
+        self._pending_count = 0
+        self.metrics = {"published": 0, "dropped": 0, "reconnects": 0}
+
+    def attach(self, deliver: Deliver, resync: Resync | None = None):
+        self.deliver = deliver
+        self.resync = resync
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        try:
+            await self._flush()
+        except Exception as e:
+            log.error(f"Broadcast: final flush failed {e}")
+        await self._disconnect()
+
+    @property
+    def connected(self) -> bool:
+        return self.connection is not None and not self.connection.is_closed()
+
+    async def publish(self, device_mac: str, message: str):
+        if len(device_mac.encode()) + len(message.encode()) + 1 > NOTIFY_MAX_BYTES:
+            log.warning(f"Broadcast: message for {device_mac} too large, dropped")
+            return
+        if not self.connected or self._pending_count >= self.max_pending:
+            self.metrics["dropped"] += 1
+            return
+        self._pending[device_mac].append(message)
+        self._pending_count += 1
+        self.metrics["published"] += 1
+
+    async def _connect(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(self.channel, self._on_notify)
+        except Exception:
+            connection.terminate()
+            raise
+        self.connection = connection
+
+    async def _disconnect(self):
+        connection, self.connection = self.connection, None
+        if connection is None or connection.is_closed():
+            return
+        try:
+            await connection.close(timeout=5)
+        except Exception:
+            # A broken connection may not finish a clean close
+            connection.terminate()
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        device_mac, _, messages = payload.partition("\n")
+        for message in messages.split("\n"):
+            self.deliver(device_mac, message)
+
+    async def _run(self):
+        first_connect = True
+        while True:
+            try:
+                if not self.connected:
+                    await self._disconnect()
+                    reconnect, first_connect = not first_connect, False
+                    if reconnect:
+                        self.metrics["reconnects"] += 1
+                    await self._connect()
+                    if reconnect and self.resync is not None:
+                        await self.resync()
+                await self._flush()
+            except Exception as e:
+                log.error(f"Broadcast: NOTIFY failed {e}")
+                await self._disconnect()
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+            await asyncio.sleep(self.flush_interval)
+
+    async def _flush(self):
+        if not self._pending or self.connection is None:
+            return
+        pending, self._pending = self._pending, defaultdict(list)
+        self._pending_count = 0
+        payloads = []
+        for device_mac, messages in pending.items():
+            payload, size = [device_mac], len(device_mac.encode())
+            for message in messages:
+                message_size = len(message.encode()) + 1
+                if len(payload) > 1 and size + message_size > NOTIFY_MAX_BYTES:
+                    payloads.append("\n".join(payload))
+                    payload, size = [device_mac], len(device_mac.encode())
+                payload.append(message)
+                size += message_size
+            payloads.append("\n".join(payload))
+        await self.connection.executemany(
+            "SELECT pg_notify($1, $2)", [(self.channel, p) for p in payloads]
+        )
+
+
+def create_broadcast(backend: str, channel: str = settings.BROADCAST_CHANNEL):
+    if backend == "postgres":
+        return PostgresBroadcast(
+            settings.ASYNC_DATABASE_URL,
+            channel,
+            settings.BROADCAST_FLUSH_INTERVAL_MS,
+            settings.BROADCAST_MAX_PENDING,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown broadcast backend {backend!r}")
+    return MemoryBroadcast()
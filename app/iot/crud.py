@@ -1,39 +1,85 @@
 # from sqlalchemy.orm import selectinload
-from operator import attrgetter
+from datetime import datetime, time, timedelta
+from typing import AsyncIterator
 
-from sqlmodel import Session, select
+import numpy as np
+from sqlalchemy import case, delete, exists
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.utils.base_crud import BaseCRUD
+from app.utils.base_crud import AsyncBaseCRUD
 from app.utils.data_time_zone import DateTimeColombia
+from app.utils.downsampling import downsample_indices
+from app.utils.frames import epoch_column, load_frame
+from app.utils.pagination import keyset_before, keyset_order
+from app.utils.time_bucket import TimeBucket, aggregate_by_bucket
 
-from .models import DataModel, DeviceModel, SetpointModel
+from .models import (
+    SENSOR_COLUMNS,
+    DataModel,
+    DataRollupDayModel,
+    DataRollupHourModel,
+    DeviceModel,
+    RollupPeriod,
+    SetpointModel,
+    ValveStatus,
+)
+from .rollups import apply_readings, rebuild_readings, rollup_response
 
+PLOT_COLUMNS = ("id", "created_at", *SENSOR_COLUMNS, "valve_status")
+# Series kept by the plot downsampling
+DEVICE_SERIES = (*SENSOR_COLUMNS, "valve_on")
 
-class GetMACCRUD(BaseCRUD):
-    def get_by_mac(self, device_mac, session: Session):
+
+class GetMACCRUD(AsyncBaseCRUD):
+    async def get_by_mac(self, device_mac, session: AsyncSession):
         statement = select(self.model).where(self.model.device_mac == device_mac)
-        result = session.exec(statement)
-        obj = result.first()
-        return obj
+        result = await session.exec(statement)
+        return result.first()
 
 
 class DeviceCRUD(GetMACCRUD):
     model = DeviceModel
 
-    def get_setpoints(self, device_mac, session: Session):
-        statement = select(self.model).where(self.model.device_mac == device_mac)
-        result = session.exec(statement)
-        obj = result.first()
-        if obj:
-            return obj.setpoints
-        return None
+    async def get_many_by_mac(self, device_macs, session: AsyncSession):
+        statement = select(self.model).where(self.model.device_mac.in_(device_macs))
+        result = await session.exec(statement)
+        return result.all()
 
-    def get_last_setpoint(self, device_mac, session: Session):
-        setpoints: list = self.get_setpoints(device_mac, session)
-        if not setpoints:
-            return None
-        setpoints = sorted(setpoints, key=attrgetter("created_at"), reverse=True)
-        return setpoints[0]
+    async def get_setpoints(self, device_mac, session: AsyncSession):
+        statement = select(SetpointModel).where(SetpointModel.device_mac == device_mac)
+        result = await session.exec(statement)
+        return result.all()
+
+    async def has_dependents(self, device_mac, session: AsyncSession) -> bool:
+        """
+        Whether the device still has setpoints or readings referencing it.
+        """
+        statement = select(
+            exists().where(SetpointModel.device_mac == device_mac)
+            | exists().where(DataModel.device_mac == device_mac)
+        )
+        result = await session.exec(statement)
+        return result.one()
+
+    async def delete(self, id, session: AsyncSession):
+        """
+        Plain DELETE, the ORM delete would load the setpoints and readings
+        relationships to null their foreign keys.
+        """
+        result = await session.exec(delete(self.model).where(self.model.id == id))
+        await session.commit()
+        return result.rowcount
+
+    async def get_last_setpoint(self, device_mac, session: AsyncSession):
+        statement = (
+            select(SetpointModel)
+            .where(SetpointModel.device_mac == device_mac)
+            .order_by(SetpointModel.created_at.desc(), SetpointModel.id.desc())
+            .limit(1)
+        )
+        result = await session.exec(statement)
+        return result.first()
 
 
 device_crud = DeviceCRUD()
@@ -49,27 +95,199 @@ setpoints_crud = SetpointsCRUD()
 class DataCRUD(GetMACCRUD):
     model = DataModel
 
-    def get_all_by_mac(self, device_mac, session: Session):
+    async def _on_insert(self, rows: list[dict], session: AsyncSession):
+        await apply_readings(rows, session)
+
+    async def _on_change(self, rows: list[dict], session: AsyncSession):
+        # An updated or deleted reading cannot be taken out of the sums, the
+        # rollups of its device and day are rebuilt from the raw readings
+        await rebuild_readings(rows, session)
+
+    async def get_all_by_mac(self, device_mac, session: AsyncSession):
         statement = select(self.model).where(self.model.device_mac == device_mac)
-        result = session.exec(statement)
-        result = result.all()
-        return [obj_db for obj_db in result]
+        result = await session.exec(statement)
+        return result.all()
 
-    def filter_data_current_day(self, skip, limit, device_mac: str, session: Session):
-        current_date = DateTimeColombia.today()
+    async def filter_data_current_day(
+        self, skip, limit, device_mac: str, session: AsyncSession, cursor=None
+    ):
+        statement = self._current_day_statement(
+            select(self.model), skip, limit, device_mac, cursor
+        )
+        result = await session.exec(statement)
+        return result.all()
 
+    async def filter_data_current_day_columns(
+        self, skip, limit, device_mac: str, session: AsyncSession, cursor=None
+    ) -> dict[str, list]:
+        """
+        Same rows as filter_data_current_day as one list per column, built
+        from the result tuples without instantiating a model per row.
+        """
+        columns = [getattr(self.model, name) for name in PLOT_COLUMNS]
+        statement = self._current_day_statement(
+            select(*columns), skip, limit, device_mac, cursor
+        )
+        result = await session.execute(statement)
+        rows = result.all()
+        if not rows:
+            return {name: [] for name in PLOT_COLUMNS}
+        return dict(zip(PLOT_COLUMNS, map(list, zip(*rows))))
+
+    async def downsample_columns(
+        self,
+        device_mac: str,
+        max_points: int,
+        session: AsyncSession,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> dict[str, list]:
+        """
+        Readings of the current day, or of [start, end), reduced to at most
+        `max_points` rows with LTTB over each sensor and the valve state, as
+        one list per column in the order of filter_data_current_day.
+        """
+        filters = [self.model.device_mac == device_mac]
+        if start is None:
+            filters.append(self.model.created_date == DateTimeColombia.today())
+        else:
+            filters += self._range_filters(start, end)
+        valve_on = case((self.model.valve_status == ValveStatus.ON, 1.0), else_=0.0)
+        # Pick the rows on column arrays, then read only the picked ones
+        series = await load_frame(
+            select(
+                self.model.id,
+                epoch_column(self.model.created_at),
+                *(getattr(self.model, name) for name in SENSOR_COLUMNS),
+                valve_on.label("valve_on"),
+            )
+            .where(*filters)
+            .order_by(self.model.created_at, self.model.id),
+            session,
+        )
+        names = (*PLOT_COLUMNS, "created_date")
+        if series.empty:
+            return {name: [] for name in names}
+        ids = series["id"].to_numpy()
+        if len(series) > max_points:
+            x = series["created_at"].astype(np.int64).to_numpy()
+            values = {name: series[name].to_numpy() for name in DEVICE_SERIES}
+            ids = ids[downsample_indices(x, values, max_points)]
         statement = (
-            select(self.model)
+            select(*(getattr(self.model, name) for name in names))
+            .where(*filters, self.model.id.in_(ids.tolist()))
+            .order_by(*keyset_order(self.model))
+        )
+        result = await session.execute(statement)
+        return dict(zip(names, map(list, zip(*result.all()))))
+
+    def _current_day_statement(self, statement, skip, limit, device_mac, cursor):
+        statement = statement.where(
+            self.model.device_mac == device_mac,
+            self.model.created_date == DateTimeColombia.today(),
+        )
+        if skip == 0 and cursor:
+            statement = statement.where(keyset_before(self.model, cursor))
+        statement = statement.order_by(*keyset_order(self.model))
+        if skip:
+            statement = statement.offset(skip)
+        return statement.limit(limit)
+
+    def stream_range(
+        self,
+        device_mac: str | None,
+        start: datetime,
+        end: datetime,
+        session: AsyncSession,
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Readings in [start, end), of one device or of all when device_mac is
+        None, streamed in batches of dicts.
+        """
+        filters = self._range_filters(start, end)
+        if device_mac is not None:
+            filters.append(self.model.device_mac == device_mac)
+        return self.stream(session, *filters)
+
+    def _range_filters(self, start: datetime, end: datetime) -> list:
+        """
+        created_at in [start, end), plus the matching created_date bounds so
+        Postgres prunes the partitions outside the range.
+        """
+        return [
+            self.model.created_at >= start,
+            self.model.created_at < end,
+            self.model.created_date >= DateTimeColombia.localize(start).date(),
+            self.model.created_date <= DateTimeColombia.localize(end).date(),
+        ]
+
+    async def aggregate(
+        self,
+        device_mac: str,
+        start: datetime,
+        end: datetime,
+        bucket: TimeBucket,
+        session: AsyncSession,
+    ) -> list[dict]:
+        """
+        min/max/avg/count of each sensor and the valve ON ratio per time bucket.
+        """
+        valve_on = case((self.model.valve_status == ValveStatus.ON, 1.0), else_=0.0)
+        return await aggregate_by_bucket(
+            session,
+            self.model.created_at,
+            [self.model.device_mac == device_mac, *self._range_filters(start, end)],
+            bucket,
+            series={name: getattr(self.model, name) for name in SENSOR_COLUMNS},
+            means={"valve_on_ratio": valve_on},
+        )
+
+    async def get_rollups(
+        self,
+        device_mac: str,
+        period: RollupPeriod,
+        start: datetime,
+        end: datetime,
+        session: AsyncSession,
+    ) -> list[dict]:
+        """
+        Stored hourly or daily rollups of the device overlapping [start, end).
+        """
+        if period == RollupPeriod.HOUR:
+            model = DataRollupHourModel
+            statement = (
+                select(model)
+                .where(
+                    model.device_mac == device_mac,
+                    model.bucket_start > start - timedelta(hours=1),
+                    model.bucket_start < end,
+                )
+                .order_by(model.bucket_start)
+            )
+            result = await session.exec(statement)
+            return [
+                rollup_response(rollup, DateTimeColombia.localize(rollup.bucket_start))
+                for rollup in result.all()
+            ]
+
+        model = DataRollupDayModel
+        statement = (
+            select(model)
             .where(
-                self.model.device_mac == device_mac,
-                self.model.created_date == current_date,
+                model.device_mac == device_mac,
+                model.day >= DateTimeColombia.localize(start).date(),
+                model.day <= DateTimeColombia.localize(end).date(),
             )
-            .order_by(self.model.created_at.desc())
-            .offset(skip)
-            .limit(limit)
+            .order_by(model.day)
         )
-        result = session.exec(statement)
-        return [obj_db for obj_db in result]
+        result = await session.exec(statement)
+        return [
+            rollup_response(
+                rollup,
+                DateTimeColombia.localize(datetime.combine(rollup.day, time.min)),
+            )
+            for rollup in result.all()
+        ]
 
 
 data_crud = DataCRUD()
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.core.config import settings
+from app.db.configDatabase import async_session_maker
+
+from .crud import data_crud
+from .models import DataCreate
+from .websocketmanager import manager
+
+log = logging.getLogger("uvicorn")
+
+
+class IngestBufferFull(Exception):
+    pass
+
+
+class IngestBuffer:
+    """
+    Bounded in-process queue of readings written to the database in
+    micro-batches, every `flush_interval_ms` or `flush_max_rows`,
+    whichever comes first.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        flush_interval_ms: int,
+        flush_max_rows: int,
+        put_timeout: float,
+    ):
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self.put_timeout = put_timeout
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+        self._stopping = False
+        self.metrics = {
+            "enqueued": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "failed_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        # New readings are written directly once stop() has begun
+        return self.task is not None and not self._stopping
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue(maxsize=self.max_size)
+            self._stopping = False
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the flusher once it has written whatever is still queued. The
+        task is not cancelled, a flush in progress always completes.
+        """
+        if self.task is None:
+            return
+        self._stopping = True
+        await self.task
+        self.task = None
+
+    async def put(self, data: DataCreate):
+        """
+        Enqueues a reading, waiting at most `put_timeout` for free space.
+
+        Raises:
+            IngestBufferFull: If the queue stays full (backpressure).
+        """
+        try:
+            await asyncio.wait_for(self.queue.put(data), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.metrics["rejected"] += 1
+            raise IngestBufferFull()
+        self.metrics["enqueued"] += 1
+
+    def get_metrics(self) -> dict:
+        flushes = self.metrics["flushes"]
+        avg_flush_ms = self.metrics["total_flush_ms"] / flushes if flushes else 0.0
+        return {
+            **self.metrics,
+            "running": self.running,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_max_size": self.max_size,
+            "avg_flush_ms": avg_flush_ms,
+        }
+
+    def _drain(self, max_rows: int) -> list:
+        batch = []
+        while len(batch) < max_rows and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while not (self._stopping and self.queue.empty()):
+            try:
+                await self._flush(await self._collect())
+            except Exception as e:
+                log.error(f"IngestBuffer: flush loop error {e}")
+
+    async def _collect(self) -> list:
+        """
+        Rows queued within one flush interval, up to flush_max_rows. Returns
+        right away what is queued once stop() has begun.
+        """
+        batch = self._drain(self.flush_max_rows)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max_rows and not self._stopping:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            batch.extend(self._drain(self.flush_max_rows - len(batch)))
+        return batch
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        start = time.perf_counter()
+        rows = await self._insert(batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.metrics["flushes"] += 1
+        self.metrics["flushed_rows"] += len(rows)
+        self.metrics["last_flush_ms"] = elapsed_ms
+        self.metrics["total_flush_ms"] += elapsed_ms
+        self.metrics["max_flush_ms"] = max(self.metrics["max_flush_ms"], elapsed_ms)
+        await manager.send_grouped(rows)
+
+    async def _insert(self, batch: list) -> list:
+        """
+        Inserts the batch in one statement. When a row is rejected, the
+        halves are inserted separately, down to single rows, so one bad
+        reading only loses itself. Any other error (connection lost,
+        database down) fails the whole batch at once.
+        """
+        try:
+            async with async_session_maker() as session:
+                return await data_crud.create_many(batch, session)
+        except (IntegrityError, DataError) as e:
+            if len(batch) == 1:
+                self.metrics["failed_rows"] += 1
+                log.error(f"IngestBuffer: reading of {batch[0].device_mac} failed {e}")
+                return []
+        except Exception as e:
+            self.metrics["failed_rows"] += len(batch)
+            log.error(f"IngestBuffer: flush of {len(batch)} readings failed {e}")
+            return []
+        middle = len(batch) // 2
+        return await self._insert(batch[:middle]) + await self._insert(batch[middle:])
+
+
+ingest_buffer = IngestBuffer(
+    max_size=settings.INGEST_BUFFER_MAX_SIZE,
+    flush_interval_ms=settings.INGEST_FLUSH_INTERVAL_MS,
+    flush_max_rows=settings.INGEST_FLUSH_MAX_ROWS,
+    put_timeout=settings.INGEST_BUFFER_PUT_TIMEOUT_SECONDS,
+)
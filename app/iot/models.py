@@ -1,11 +1,16 @@
 from datetime import date, datetime
 from enum import Enum
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic import BaseModel
-from sqlmodel import Field, Relationship, SQLModel
+from sqlalchemy import DateTime
+from sqlmodel import Field, Index, Relationship, SQLModel
 
+from app.core.config import settings
 from app.utils.data_time_zone import DateTimeColombia
+from weather.models import WeatherAPIResponse
+
+SENSOR_COLUMNS = ("temperature", "humidity_1", "humidity_2")
 
 
 # Definición del Enum para el estado de la válvula
@@ -17,8 +22,14 @@ class ValveStatus(str, Enum):
 # Clase base que contiene los campos comunes
 class BaseTable(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=DateTimeColombia.now, index=True)
-    updated_at: datetime = Field(default_factory=DateTimeColombia.now)
+    created_at: datetime = Field(
+        default_factory=DateTimeColombia.now,
+        index=True,
+        sa_type=DateTime(timezone=True),
+    )
+    updated_at: datetime = Field(
+        default_factory=DateTimeColombia.now, sa_type=DateTime(timezone=True)
+    )
     created_date: date = Field(default_factory=DateTimeColombia.today)
 
 
@@ -26,6 +37,8 @@ class BaseTable(SQLModel):
 class DeviceModel(BaseTable, table=True):
     device_mac: str = Field(unique=True, nullable=False, index=True)
     description: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     setpoints: list["SetpointModel"] = Relationship(back_populates="device")
     data: list["DataModel"] = Relationship(back_populates="device")
 
@@ -40,25 +53,41 @@ class DeviceResponse(BaseModel):
     id: int
     device_mac: str
     description: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 
 class DeviceCreate(BaseModel):
     device_mac: str
     description: str
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
 
 
 class DeviceUpdate(BaseModel):
     device_mac: Optional[str]
     description: Optional[str]
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
 
 
 # Definición del modelo HistoricoSetpoint
 class SetpointModel(BaseTable, table=True):
+    __table_args__ = (
+        Index("ix_setpointmodel_device_mac_created_at", "device_mac", "created_at"),
+    )
+
     setpoint: float
     device_mac: str = Field(foreign_key="devicemodel.device_mac", index=True)
     device: DeviceModel = Relationship(back_populates="setpoints")
 
 
+class DeviceWeatherResponse(BaseModel):
+    device_mac: str
+    geohash: str
+    weather: WeatherAPIResponse
+
+
 class SetpointCreate(BaseModel):
     setpoint: float
     device_mac: str
@@ -73,6 +102,23 @@ class SetpointResponse(BaseModel):
 
 # Definición del modelo Data
 class DataModel(BaseTable, table=True):
+    __table_args__ = (
+        Index("ix_datamodel_device_mac_created_at", "device_mac", "created_at"),
+        (
+            {"postgresql_partition_by": "RANGE (created_date)"}
+            if settings.DATA_PARTITIONING_ENABLED
+            else {}
+        ),
+    )
+
+    # A partitioned table needs the partition key in its primary key
+    id: Optional[int] = Field(
+        default=None, primary_key=True, sa_column_kwargs={"autoincrement": True}
+    )
+    created_date: date = Field(
+        default_factory=DateTimeColombia.today,
+        primary_key=settings.DATA_PARTITIONING_ENABLED,
+    )
     device_mac: str = Field(foreign_key="devicemodel.device_mac", index=True)
     temperature: float
     humidity_1: float
@@ -81,6 +127,40 @@ class DataModel(BaseTable, table=True):
     device: DeviceModel = Relationship(back_populates="data")
 
 
+class DataRollupBase(SQLModel):
+    device_mac: str = Field(primary_key=True)
+    count: int
+    temperature_sum: float
+    temperature_min: float
+    temperature_max: float
+    humidity_1_sum: float
+    humidity_1_min: float
+    humidity_1_max: float
+    humidity_2_sum: float
+    humidity_2_min: float
+    humidity_2_max: float
+    valve_on_count: int
+    valve_on_seconds: float = 0
+
+
+class DataRollupHourModel(DataRollupBase, table=True):
+    bucket_start: datetime = Field(primary_key=True, sa_type=DateTime(timezone=True))
+
+
+class DataRollupDayModel(DataRollupBase, table=True):
+    day: date = Field(primary_key=True)
+
+
+class RollupPeriod(str, Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+
+class PlotFormat(str, Enum):
+    ROWS = "rows"
+    COLUMNAR = "columnar"
+
+
 class DataCreate(BaseModel):
     temperature: float
     humidity_1: float
@@ -98,3 +178,73 @@ class DataResponse(BaseModel):
     humidity_2: float
     valve_status: ValveStatus
     device_mac: str
+
+
+class DataBatchResponse(BaseModel):
+    inserted: int
+    devices: dict[str, int]
+
+
+class DataAccepted(BaseModel):
+    queued: bool
+    queue_depth: int
+
+
+class DataAggregateResponse(BaseModel):
+    bucket_start: datetime
+    count: int
+    temperature_min: float
+    temperature_max: float
+    temperature_avg: float
+    humidity_1_min: float
+    humidity_1_max: float
+    humidity_1_avg: float
+    humidity_2_min: float
+    humidity_2_max: float
+    humidity_2_avg: float
+    valve_on_ratio: float
+
+
+class LaggedCorrelation(BaseModel):
+    lag_hours: int
+    # Hours with both a device and a weather mean
+    hours: int
+    correlations: Dict[str, Dict[str, Optional[float]]]
+
+
+class WeatherCorrelationResponse(BaseModel):
+    device_mac: str
+    city_name: str
+    start: datetime
+    end: datetime
+    # Readings joined to a weather observation
+    matched: int
+    # device column -> weather column -> Pearson correlation
+    correlations: Dict[str, Dict[str, Optional[float]]]
+    lagged: list[LaggedCorrelation]
+
+
+class SubscriptionAction(str, Enum):
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+
+
+class SubscriptionMessage(BaseModel):
+    action: SubscriptionAction
+    devices: list[str]
+
+
+class DataRollupResponse(BaseModel):
+    bucket_start: datetime
+    count: int
+    temperature_min: float
+    temperature_max: float
+    temperature_avg: float
+    humidity_1_min: float
+    humidity_1_max: float
+    humidity_1_avg: float
+    humidity_2_min: float
+    humidity_2_max: float
+    humidity_2_avg: float
+    valve_on_count: int
+    valve_on_seconds: float
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.db.configDatabase import async_engine
+from app.utils.data_time_zone import DateTimeColombia
+
+from .models import DataModel
+from .rollups import rebuild_day
+
+log = logging.getLogger("uvicorn")
+
+PARENT_TABLE = DataModel.__tablename__
+PARTITION_PREFIX = f"{PARENT_TABLE}_p"
+# Serializes the maintenance of several workers
+MAINTENANCE_LOCK_KEY = 7_301_001
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+async def create_partitions(conn, first_day: date, last_day: date):
+    """
+    Creates the daily partitions of [first_day, last_day] that do not exist.
+    """
+    day = first_day
+    while day <= last_day:
+        await conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(day)} "
+                f"PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{day.isoformat()}') "
+                f"TO ('{(day + timedelta(days=1)).isoformat()}')"
+            )
+        )
+        day += timedelta(days=1)
+
+
+async def list_partitions(conn) -> list[tuple[str, date]]:
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :parent"
+        ),
+        {"parent": PARENT_TABLE},
+    )
+    partitions = []
+    for (name,) in result:
+        if name.startswith(PARTITION_PREFIX):
+            day = datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y%m%d").date()
+            partitions.append((name, day))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def _lock(conn):
+    await conn.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}
+    )
+
+
+async def run_maintenance():
+    """
+    Creates the partitions for the next DATA_PARTITION_PREMAKE_DAYS days and,
+    when DATA_RETENTION_DAYS is set, rebuilds the rollups of the older ones
+    and drops them.
+
+    Each step commits on its own: creating or dropping a partition locks the
+    parent table until its transaction ends, which would block the rebuild
+    reading it from another connection. The rebuild cannot share the drop's
+    transaction either, its server-side cursor keeps the partition in use
+    until the transaction ends.
+    """
+    today = DateTimeColombia.today()
+    async with async_engine.begin() as conn:
+        await _lock(conn)
+        await create_partitions(
+            conn,
+            today - timedelta(days=1),
+            today + timedelta(days=settings.DATA_PARTITION_PREMAKE_DAYS),
+        )
+    if settings.DATA_RETENTION_DAYS <= 0:
+        return
+    oldest_kept = today - timedelta(days=settings.DATA_RETENTION_DAYS)
+    async with async_engine.connect() as conn:
+        partitions = await list_partitions(conn)
+    for name, day in partitions:
+        if day >= oldest_kept:
+            break
+        async with async_engine.begin() as conn:
+            await _lock(conn)
+            await rebuild_day(conn, day)
+        async with async_engine.begin() as conn:
+            await _lock(conn)
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        log.info(f"Partitions: {name} compacted into rollups and dropped")
+
+
+class PartitionMaintainer:
+    def __init__(self, interval_seconds: int):
+        self.interval_seconds = interval_seconds
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await run_maintenance()
+            except Exception as e:
+                log.error(f"Partitions: maintenance failed {e}")
+
+
+partition_maintainer = PartitionMaintainer(
+    interval_seconds=settings.DATA_MAINTENANCE_INTERVAL_SECONDS
+)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.db.configDatabase import async_session_maker
+from app.utils import geohash
+
+from .crud import device_crud
+from .models import DeviceModel, DeviceResponse
+
+log = logging.getLogger("uvicorn")
+
+
+class DeviceRegistry:
+    """
+    In-memory map of device_mac -> device, loaded at startup, kept in sync by
+    the device routes and refreshed periodically so several workers converge.
+
+    A MAC missing from memory is looked up in the database once (it may have
+    been created by another worker) and cached if it exists.
+
+    Devices with a location are also indexed by their geohash cell
+    (device_mac -> geohash), the key of their local weather.
+    """
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self.devices: Dict[str, DeviceResponse] = {}
+        self.cells: Dict[str, str] = {}
+        self.task: asyncio.Task | None = None
+
+    async def load(self, session: AsyncSession):
+        result = await session.exec(select(DeviceModel))
+        devices = result.all()
+        self.devices = {device.device_mac: self._snapshot(device) for device in devices}
+        self.cells = {
+            device.device_mac: self._cell(device)
+            for device in devices
+            if self._cell(device) is not None
+        }
+
+    def add(self, device: DeviceModel):
+        self.devices[device.device_mac] = self._snapshot(device)
+        cell = self._cell(device)
+        if cell is None:
+            self.cells.pop(device.device_mac, None)
+        else:
+            self.cells[device.device_mac] = cell
+
+    def remove(self, device_mac: str):
+        self.devices.pop(device_mac, None)
+        self.cells.pop(device_mac, None)
+
+    def cell_of(self, device_mac: str) -> Optional[str]:
+        """
+        Geohash cell of a cached device, None when it has no location.
+        """
+        return self.cells.get(device_mac)
+
+    async def get_by_mac(
+        self, device_mac: str, session: AsyncSession = None
+    ) -> Optional[DeviceResponse]:
+        device = self.devices.get(device_mac)
+        if device is None and session is not None:
+            device_db = await device_crud.get_by_mac(device_mac, session)
+            if device_db:
+                self.add(device_db)
+                device = self.devices[device_mac]
+        return device
+
+    async def missing(
+        self, device_macs: Iterable[str], session: AsyncSession = None
+    ) -> set:
+        unknown = {mac for mac in device_macs if mac not in self.devices}
+        if unknown and session is not None:
+            for device_db in await device_crud.get_many_by_mac(unknown, session):
+                self.add(device_db)
+                unknown.discard(device_db.device_mac)
+        return unknown
+
+    def start(self):
+        if self.task is None and self.refresh_seconds > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                async with async_session_maker() as session:
+                    await self.load(session)
+            except Exception as e:
+                log.error(f"DeviceRegistry: refresh failed {e}")
+
+    @staticmethod
+    def _snapshot(device: DeviceModel) -> DeviceResponse:
+        return DeviceResponse(
+            id=device.id,
+            device_mac=device.device_mac,
+            description=device.description,
+            latitude=device.latitude,
+            longitude=device.longitude,
+        )
+
+    @staticmethod
+    def _cell(device: DeviceModel) -> Optional[str]:
+        if device.latitude is None or device.longitude is None:
+            return None
+        return geohash.encode(
+            device.latitude, device.longitude, settings.WEATHER_GEOHASH_PRECISION
+        )
+
+
+device_registry = DeviceRegistry(
+    refresh_seconds=settings.DEVICE_REGISTRY_REFRESH_SECONDS
+)
@@ -0,0 +1,271 @@
+"""
+Hourly and daily rollups of the readings of each device, updated on every
+insert, rebuilt for the affected day when a reading is updated or deleted and
+rebuilt from the raw readings by repair_rollups.py.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import case, delete, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.core.config import settings
+from app.utils.data_time_zone import DateTimeColombia
+
+from .models import (
+    SENSOR_COLUMNS,
+    DataModel,
+    DataRollupDayModel,
+    DataRollupHourModel,
+    ValveStatus,
+)
+
+ADDITIVE_COLUMNS = (
+    "count",
+    *(f"{name}_sum" for name in SENSOR_COLUMNS),
+    "valve_on_count",
+    "valve_on_seconds",
+)
+
+
+class ValveClock:
+    """
+    Last reading of each device, gives the seconds the valve stayed ON since
+    the previous reading. Gaps are capped at max_gap_seconds and readings
+    older than the last one seen count nothing.
+    """
+
+    def __init__(self, max_gap_seconds: float):
+        self.max_gap_seconds = max_gap_seconds
+        self.last: dict[str, tuple[datetime, ValveStatus]] = {}
+
+    def tick(self, device_mac: str, created_at: datetime, valve_status) -> float:
+        previous = self.last.get(device_mac)
+        if previous is not None and created_at < previous[0]:
+            return 0.0
+        self.last[device_mac] = (created_at, valve_status)
+        if previous is None or previous[1] != ValveStatus.ON:
+            return 0.0
+        elapsed = (created_at - previous[0]).total_seconds()
+        return min(elapsed, self.max_gap_seconds)
+
+
+class RollupAccumulator:
+    """
+    Rollup rows of a set of readings, by (device_mac, hour) and
+    (device_mac, day).
+    """
+
+    def __init__(self):
+        self.hours: dict[tuple, dict] = {}
+        self.days: dict[tuple, dict] = {}
+
+    def add(self, reading: dict, valve_on_seconds: float):
+        device_mac = reading["device_mac"]
+        created_at = DateTimeColombia.localize(reading["created_at"])
+        hour = created_at.replace(minute=0, second=0, microsecond=0)
+        day = reading["created_date"]
+        for rollups, key, bucket in (
+            (self.hours, (device_mac, hour), {"bucket_start": hour}),
+            (self.days, (device_mac, day), {"day": day}),
+        ):
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollups[key] = {
+                    "device_mac": device_mac,
+                    **bucket,
+                    **_reading_rollup(reading, valve_on_seconds),
+                }
+            else:
+                _merge(rollup, _reading_rollup(reading, valve_on_seconds))
+
+
+def _reading_rollup(reading: dict, valve_on_seconds: float) -> dict:
+    rollup = {
+        "count": 1,
+        "valve_on_count": int(reading["valve_status"] == ValveStatus.ON),
+        "valve_on_seconds": valve_on_seconds,
+    }
+    for name in SENSOR_COLUMNS:
+        value = reading[name]
+        rollup[f"{name}_sum"] = rollup[f"{name}_min"] = rollup[f"{name}_max"] = value
+    return rollup
+
+
+def _merge(rollup: dict, other: dict):
+    for name in ADDITIVE_COLUMNS:
+        rollup[name] += other[name]
+    for name in SENSOR_COLUMNS:
+        rollup[f"{name}_min"] = min(rollup[f"{name}_min"], other[f"{name}_min"])
+        rollup[f"{name}_max"] = max(rollup[f"{name}_max"], other[f"{name}_max"])
+
+
+def _dialect_name(bind) -> str:
+    # AsyncConnection has a dialect, AsyncSession gets it from its bind
+    if hasattr(bind, "dialect"):
+        return bind.dialect.name
+    return bind.get_bind().dialect.name
+
+
+async def _upsert(bind, model, index_elements: list[str], rows: list[dict]):
+    """
+    Adds `rows` to the stored rollups: sums and counts are added, min and
+    max are combined.
+    """
+    if not rows:
+        return
+    dialect = _dialect_name(bind)
+    if dialect == "postgresql":
+        dialect_insert = postgresql.insert
+    elif dialect == "sqlite":
+        dialect_insert = sqlite.insert
+    else:
+        raise ValueError(f"Rollups are not supported on {dialect!r}")
+    table = model.__table__
+    statement = dialect_insert(table)
+    excluded = statement.excluded
+    set_ = {name: table.c[name] + excluded[name] for name in ADDITIVE_COLUMNS}
+    for name in SENSOR_COLUMNS:
+        low, high = f"{name}_min", f"{name}_max"
+        set_[low] = case(
+            (excluded[low] < table.c[low], excluded[low]), else_=table.c[low]
+        )
+        set_[high] = case(
+            (excluded[high] > table.c[high], excluded[high]), else_=table.c[high]
+        )
+    statement = statement.on_conflict_do_update(
+        index_elements=index_elements, set_=set_
+    )
+    await bind.execute(statement, rows)
+
+
+valve_clock = ValveClock(max_gap_seconds=settings.ROLLUP_VALVE_MAX_GAP_SECONDS)
+
+
+async def apply_readings(readings: list[dict], bind, clock: ValveClock = valve_clock):
+    """
+    Adds newly inserted readings to the rollups, in the caller's transaction.
+
+    Valve ON seconds come from the last reading each process has seen of the
+    device, the repair command recomputes them exactly from the raw rows.
+    """
+    if not settings.DATA_ROLLUPS_ENABLED or not readings:
+        return
+    accumulator = RollupAccumulator()
+    for reading in sorted(readings, key=lambda reading: reading["created_at"]):
+        seconds = clock.tick(
+            reading["device_mac"], reading["created_at"], reading["valve_status"]
+        )
+        accumulator.add(reading, seconds)
+    await _upsert(
+        bind,
+        DataRollupHourModel,
+        ["device_mac", "bucket_start"],
+        list(accumulator.hours.values()),
+    )
+    await _upsert(
+        bind, DataRollupDayModel, ["device_mac", "day"], list(accumulator.days.values())
+    )
+
+
+async def rebuild_day(conn, day: date, device_mac: str | None = None):
+    """
+    Replaces the rollups of one day (of one device or of all) with the ones
+    computed from its raw readings.
+    """
+    filters = [DataModel.created_date == day]
+    hour_filters = [
+        DataRollupHourModel.bucket_start >= _day_start(day),
+        DataRollupHourModel.bucket_start < _day_start(day + timedelta(days=1)),
+    ]
+    day_filters = [DataRollupDayModel.day == day]
+    if device_mac is not None:
+        filters.append(DataModel.device_mac == device_mac)
+        hour_filters.append(DataRollupHourModel.device_mac == device_mac)
+        day_filters.append(DataRollupDayModel.device_mac == device_mac)
+
+    statement = (
+        select(
+            DataModel.device_mac,
+            DataModel.created_at,
+            DataModel.created_date,
+            *(getattr(DataModel, name) for name in SENSOR_COLUMNS),
+            DataModel.valve_status,
+        )
+        .where(*filters)
+        .order_by(DataModel.device_mac, DataModel.created_at, DataModel.id)
+        .execution_options(yield_per=settings.STREAM_BATCH_SIZE)
+    )
+    clock = ValveClock(max_gap_seconds=settings.ROLLUP_VALVE_MAX_GAP_SECONDS)
+    accumulator = RollupAccumulator()
+    result = await conn.stream(statement)
+    async for partition in result.mappings().partitions():
+        for reading in partition:
+            seconds = clock.tick(
+                reading["device_mac"], reading["created_at"], reading["valve_status"]
+            )
+            accumulator.add(reading, seconds)
+
+    await conn.execute(delete(DataRollupHourModel).where(*hour_filters))
+    await conn.execute(delete(DataRollupDayModel).where(*day_filters))
+    if accumulator.hours:
+        await conn.execute(
+            insert(DataRollupHourModel), list(accumulator.hours.values())
+        )
+        await conn.execute(insert(DataRollupDayModel), list(accumulator.days.values()))
+
+
+async def rebuild_readings(readings: list[dict], bind):
+    """
+    Rebuilds the rollups of the (device, day) of each reading, in the
+    caller's transaction. Used when stored readings are updated or deleted.
+    """
+    if not settings.DATA_ROLLUPS_ENABLED or not readings:
+        return
+    if hasattr(bind, "flush"):
+        # The rebuild must read the session's pending changes
+        await bind.flush()
+    for day, device_mac in sorted(
+        {(reading["created_date"], reading["device_mac"]) for reading in readings}
+    ):
+        await rebuild_day(bind, day, device_mac)
+
+
+async def rebuild_days(
+    conn, first_day: date, last_day: date, device_mac: str | None = None
+) -> list[date]:
+    """
+    rebuild_day for every day of [first_day, last_day] that still has raw
+    readings, days whose readings were dropped keep their rollups.
+    """
+    filters = [DataModel.created_date >= first_day, DataModel.created_date <= last_day]
+    if device_mac is not None:
+        filters.append(DataModel.device_mac == device_mac)
+    result = await conn.execute(
+        select(DataModel.created_date).where(*filters).distinct()
+    )
+    days = sorted(result.scalars().all())
+    for day in days:
+        await rebuild_day(conn, day, device_mac)
+    return days
+
+
+def _day_start(day: date) -> datetime:
+    return DateTimeColombia.localize(datetime.combine(day, time.min))
+
+
+def rollup_response(rollup, bucket_start: datetime) -> dict:
+    """
+    API view of a stored rollup: the sums become averages.
+    """
+    response = {
+        "bucket_start": bucket_start,
+        "count": rollup.count,
+        "valve_on_count": rollup.valve_on_count,
+        "valve_on_seconds": rollup.valve_on_seconds,
+    }
+    for name in SENSOR_COLUMNS:
+        response[f"{name}_min"] = getattr(rollup, f"{name}_min")
+        response[f"{name}_max"] = getattr(rollup, f"{name}_max")
+        response[f"{name}_avg"] = getattr(rollup, f"{name}_sum") / rollup.count
+    return response
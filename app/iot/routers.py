@@ -1,69 +1,168 @@
 import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from pydantic_core import to_json
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.configDatabase import async_session_maker, get_async_session
+from app.utils.data_time_zone import DateTimeColombia
+from app.utils.etag import etag_matches
+from app.utils.export import ExportFormat, export_stream, pyarrow_available
+from app.utils.pagination import (
+    NEXT_CURSOR_HEADER,
+    columns_next_cursor,
+    set_next_cursor,
+)
+from app.utils.streaming import StreamFormat, encode_stream
+from app.utils.time_bucket import TimeBucket
+from weather.models import GridCell
+from weather.services.cache import cell_weather_cache
+from weather.services.external_api import create_weather_api_response
 
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from sqlmodel import Session
-
-from app.db.configDatabase import get_session
-
+from .analytics import weather_correlation
 from .crud import data_crud, device_crud, setpoints_crud
+from .ingest_buffer import IngestBufferFull, ingest_buffer
 from .models import (
+    DataAccepted,
+    DataAggregateResponse,
+    DataBatchResponse,
     DataCreate,
     DataResponse,
+    DataRollupResponse,
     DeviceCreate,
     DeviceResponse,
     DeviceUpdate,
+    DeviceWeatherResponse,
+    PlotFormat,
+    RollupPeriod,
     SetpointCreate,
     SetpointResponse,
+    SubscriptionAction,
+    SubscriptionMessage,
+    WeatherCorrelationResponse,
 )
+from .registry import device_registry
+from .setpoint_cache import setpoint_cache
 from .websocketmanager import manager
 
 device_routes = APIRouter(prefix="/device", tags=["device"])
 
 
 @device_routes.get("/", response_model=list[DeviceResponse])
-def read_devices(
-    skip: int = 0, limit: int = 100, session: Session = Depends(get_session)
+async def read_devices(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_async_session),
 ):
-    devices = device_crud.get_all(skip, limit, session)
+    if skip:
+        return await device_crud.get_all(skip, limit, session)
+    devices = await device_crud.get_page(cursor, limit, session)
+    set_next_cursor(response, devices, limit)
     return devices
 
 
 @device_routes.get("/{device_id}", response_model=DeviceResponse)
-def read_device(device_id: int, session: Session = Depends(get_session)):
-    device = device_crud.get_by_id(device_id, session)
+async def read_device(
+    device_id: int, session: AsyncSession = Depends(get_async_session)
+):
+    device = await device_crud.get_by_id(device_id, session)
     if device is None:
         raise HTTPException(status_code=404, detail="device not found")
     return device
 
 
-@device_routes.get("/setpoint/{device_mac}", response_model=SetpointResponse)
-def read_last_setpoint(device_mac: str, session: Session = Depends(get_session)):
-    device = device_crud.get_by_mac(device_mac, session)
+async def _last_setpoint(
+    device_mac: str, request: Request, response: Response, session: AsyncSession
+):
+    """
+    Latest setpoint of a polled device with its ETag, or a bodyless 304 when
+    the device already has it (If-None-Match), both served from the setpoint
+    cache.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
     if device is None:
         raise HTTPException(status_code=404, detail="device not found")
 
-    setpoint = device_crud.get_last_setpoint(device_mac, session)
+    setpoint, etag = await setpoint_cache.get_versioned(device_mac, session)
     if setpoint is None:
         raise HTTPException(
             status_code=404, detail="device dont have setpoint created yet"
         )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return setpoint
 
 
+@device_routes.get("/setpoint/{device_mac}", response_model=SetpointResponse)
+async def read_last_setpoint(
+    device_mac: str,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    return await _last_setpoint(device_mac, request, response, session)
+
+
+@device_routes.get("/{device_mac}/weather", response_model=DeviceWeatherResponse)
+async def read_device_weather(
+    device_mac: str, session: AsyncSession = Depends(get_async_session)
+):
+    device = await device_registry.get_by_mac(device_mac, session)
+    if device is None:
+        raise HTTPException(status_code=404, detail="device not found")
+    cell = device_registry.cell_of(device_mac)
+    if cell is None:
+        raise HTTPException(status_code=404, detail="device has no location")
+
+    # Devices in the same cell share one cached upstream response
+    data = await cell_weather_cache.get(GridCell(geohash=cell))
+    if data is None or data.get("cod") in ("404", 404):
+        raise HTTPException(status_code=503, detail="Weather service unavailable")
+    return DeviceWeatherResponse(
+        device_mac=device_mac,
+        geohash=cell,
+        weather=create_weather_api_response(data),
+    )
+
+
 @device_routes.post("/", response_model=DeviceResponse)
-def create_device(device: DeviceCreate, session: Session = Depends(get_session)):
-    device_db = device_crud.get_by_mac(device.device_mac, session)
+async def create_device(
+    device: DeviceCreate, session: AsyncSession = Depends(get_async_session)
+):
+    device_db = await device_registry.get_by_mac(device.device_mac, session)
     if device_db:
         raise HTTPException(status_code=404, detail="device already created")
-    return device_crud.create(device, session)
+    device_db = await device_crud.create(device, session)
+    device_registry.add(device_db)
+    return device_db
 
 
 @device_routes.put("/{device_id}", response_model=DeviceResponse)
-def update_device(
-    device_id: int, device: DeviceUpdate, session: Session = Depends(get_session)
+async def update_device(
+    device_id: int,
+    device: DeviceUpdate,
+    session: AsyncSession = Depends(get_async_session),
 ):
     # Check if device_id exists
-    existing_device = device_crud.get_by_id(device_id, session)
+    existing_device = await device_crud.get_by_id(device_id, session)
     if existing_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     if device.device_mac:
@@ -73,15 +172,27 @@ def update_device(
     else:
         device.device_mac = existing_device.device_mac
 
-    updated_device = device_crud.update(device_id, device, session)
+    updated_device = await device_crud.update(device_id, device, session)
+    device_registry.add(updated_device)
     return updated_device
 
 
 @device_routes.delete("/{device_id}")
-def delete_device(device_id: int, session: Session = Depends(get_session)):
-    deleted = delete_device(device_id, session)
-    if not deleted:
+async def delete_device(
+    device_id: int, session: AsyncSession = Depends(get_async_session)
+):
+    device = await device_crud.get_by_id(device_id, session)
+    if device is None:
         raise HTTPException(status_code=404, detail="device not found")
+    if await device_crud.has_dependents(device.device_mac, session):
+        raise HTTPException(status_code=409, detail="device has setpoints or readings")
+    try:
+        await device_crud.delete(device_id, session)
+    except IntegrityError:
+        # A reading arrived between the check and the delete
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="device has setpoints or readings")
+    device_registry.remove(device.device_mac)
     return {"message": "device deleted"}
 
 
@@ -90,60 +201,77 @@ setpoints_routes = APIRouter(prefix="/setpoints", tags=["setpoints"])
 
 
 @setpoints_routes.get("/", response_model=list[SetpointResponse])
-def read_setpoints(
-    skip: int = 0, limit: int = 100, session: Session = Depends(get_session)
+async def read_setpoints(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_async_session),
 ):
-    setpoints = setpoints_crud.get_all(skip, limit, session)
+    if skip:
+        return await setpoints_crud.get_all(skip, limit, session)
+    setpoints = await setpoints_crud.get_page(cursor, limit, session)
+    set_next_cursor(response, setpoints, limit)
     return setpoints
 
 
 @setpoints_routes.get("/{setpoint_id}", response_model=SetpointResponse)
-def read_setpoint(setpoint_id: int, session: Session = Depends(get_session)):
-    setpoint = setpoints_crud.get_by_id(setpoint_id, session)
+async def read_setpoint(
+    setpoint_id: int, session: AsyncSession = Depends(get_async_session)
+):
+    setpoint = await setpoints_crud.get_by_id(setpoint_id, session)
     if setpoint is None:
         raise HTTPException(status_code=404, detail="Setpoint not found")
     return setpoint
 
 
 @setpoints_routes.get("/device/{device_mac}", response_model=SetpointResponse)
-def read_setpoint_by_mac(device_mac: str, session: Session = Depends(get_session)):
-    device = device_crud.get_by_mac(device_mac, session)
-    if device is None:
-        raise HTTPException(status_code=404, detail="device not found")
-
-    setpoint = device_crud.get_last_setpoint(device_mac, session)
-    if setpoint is None:
-        raise HTTPException(
-            status_code=404, detail="device dont have setpoint created yet"
-        )
-    return setpoint
+async def read_setpoint_by_mac(
+    device_mac: str,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    return await _last_setpoint(device_mac, request, response, session)
 
 
 @setpoints_routes.post("/", response_model=SetpointResponse)
-def create_setpoint(setpoint: SetpointCreate, session: Session = Depends(get_session)):
-    device = device_crud.get_by_mac(setpoint.device_mac, session)
+async def create_setpoint(
+    setpoint: SetpointCreate, session: AsyncSession = Depends(get_async_session)
+):
+    device = await device_registry.get_by_mac(setpoint.device_mac, session)
     if device is None:
         raise HTTPException(status_code=404, detail="device not found")
-    return setpoints_crud.create(setpoint, session)
+    setpoint_db = await setpoints_crud.create(setpoint, session)
+    await setpoint_cache.set(setpoint_db.device_mac, setpoint_db)
+    return setpoint_db
 
 
 @setpoints_routes.put("/{setpoint_id}", response_model=SetpointResponse)
-def update_setpoint(
+async def update_setpoint(
     setpoint_id: int,
     setpoint: SetpointCreate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
-    setpoint = setpoints_crud.update(setpoint_id, setpoint, session)
-    if setpoint is None:
+    existing_setpoint = await setpoints_crud.get_by_id(setpoint_id, session)
+    if existing_setpoint is None:
         raise HTTPException(status_code=404, detail="Setpoint not found")
+    previous_mac = existing_setpoint.device_mac
+    setpoint = await setpoints_crud.update(setpoint_id, setpoint, session)
+    await setpoint_cache.invalidate(previous_mac)
+    await setpoint_cache.invalidate(setpoint.device_mac)
     return setpoint
 
 
 @setpoints_routes.delete("/{setpoint_id}")
-def delete_setpoint(setpoint_id: int, session: Session = Depends(get_session)):
-    deleted = setpoints_crud.delete(setpoint_id, session)
-    if not deleted:
+async def delete_setpoint(
+    setpoint_id: int, session: AsyncSession = Depends(get_async_session)
+):
+    setpoint = await setpoints_crud.get_by_id(setpoint_id, session)
+    if setpoint is None:
         raise HTTPException(status_code=404, detail="Setpoint not found")
+    await setpoints_crud.delete(setpoint_id, session)
+    await setpoint_cache.invalidate(setpoint.device_mac)
     return {"message": "Setpoint deleted"}
 
 
@@ -153,63 +281,351 @@ data_routes = APIRouter(prefix="/data", tags=["data"])
 
 
 @data_routes.get("/", response_model=list[DataResponse])
-def read_data(skip: int = 0, limit: int = 100, session: Session = Depends(get_session)):
-    data_list = data_crud.get_all(skip, limit, session)
+async def read_data(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_async_session),
+):
+    if skip:
+        return await data_crud.get_all(skip, limit, session)
+    data_list = await data_crud.get_page(cursor, limit, session)
+    set_next_cursor(response, data_list, limit)
     return data_list
 
 
+@data_routes.get("/export")
+async def export_data(
+    start: datetime,
+    end: datetime | None = None,
+    device_mac: str | None = None,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Streams the readings of one device (or of all of them) in [start, end)
+    as CSV, NDJSON, Arrow IPC stream or Parquet. end defaults to now.
+    """
+    if device_mac is not None:
+        device = await device_registry.get_by_mac(device_mac, session)
+        if not device:
+            raise HTTPException(status_code=404, detail="Device Mac not found")
+    if export_format.requires_pyarrow and not pyarrow_available():
+        raise HTTPException(
+            status_code=400, detail=f"{export_format.value} export requires pyarrow"
+        )
+    start = DateTimeColombia.localize(start)
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    filename = f"data_{device_mac or 'all'}_{start:%Y%m%d}_{end:%Y%m%d}"
+    return StreamingResponse(
+        export_stream(
+            _data_batches(device_mac, start, end), export_format, data_crud.model
+        ),
+        media_type=export_format.media_type,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{filename}.{export_format.value}"'
+            )
+        },
+    )
+
+
 @data_routes.get("/{data_id}", response_model=DataResponse)
-def read_data_by_id(data_id: int, session: Session = Depends(get_session)):
-    data = data_crud.get_by_id(data_id, session)
+async def read_data_by_id(
+    data_id: int, session: AsyncSession = Depends(get_async_session)
+):
+    data = await data_crud.get_by_id(data_id, session)
     if data is None:
         raise HTTPException(status_code=404, detail="Data not found")
     return data
 
 
 @data_routes.get("/device/{device_mac}", response_model=list[DataResponse])
-def read_data_for_plot(
+async def read_data_for_plot(
     device_mac: str,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    session: Session = Depends(get_session),
+    cursor: str | None = None,
+    plot_format: PlotFormat = Query(PlotFormat.ROWS, alias="format"),
+    max_points: int | None = Query(None, ge=20),
+    start: datetime | None = None,
+    end: datetime | None = None,
+    session: AsyncSession = Depends(get_async_session),
 ):
-    device = device_crud.get_by_mac(device_mac, session)
+    """
+    Readings of the current day, newest first, one page of `limit` rows.
+
+    With `max_points` the whole day, or [start, end) when given (end
+    defaults to now, start to a day before end), comes back as one response
+    of at most `max_points` rows picked by LTTB downsampling, which keeps
+    the spikes and valve changes an average would hide.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
     if not device:
         raise HTTPException(status_code=404, detail="Device Mac not found")
-    data = data_crud.filter_data_current_day(skip, limit, device_mac, session)
+    if max_points is not None:
+        if start is not None or end is not None:
+            end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+            start = (
+                DateTimeColombia.localize(start) if start else end - timedelta(days=1)
+            )
+            if start >= end:
+                raise HTTPException(status_code=400, detail="start must be before end")
+        columns = await data_crud.downsample_columns(
+            device_mac, max_points, session, start=start, end=end
+        )
+        if plot_format == PlotFormat.ROWS:
+            names = list(columns)
+            rows = [
+                dict(zip(names, values), device_mac=device_mac)
+                for values in zip(*columns.values())
+            ]
+            return Response(content=to_json(rows), media_type="application/json")
+        del columns["created_date"]
+        return Response(content=to_json(columns), media_type="application/json")
+    if plot_format == PlotFormat.COLUMNAR:
+        columns = await data_crud.filter_data_current_day_columns(
+            skip, limit, device_mac, session, cursor=cursor
+        )
+        headers = {}
+        next_page = columns_next_cursor(columns, limit)
+        if next_page:
+            headers[NEXT_CURSOR_HEADER] = next_page
+        return Response(
+            content=to_json(columns), media_type="application/json", headers=headers
+        )
+    data = await data_crud.filter_data_current_day(
+        skip, limit, device_mac, session, cursor=cursor
+    )
     if data is None:
         raise HTTPException(status_code=404, detail="Data not found")
+    set_next_cursor(response, data, limit)
     return data
 
 
-@data_routes.post("/", response_model=DataResponse)
-async def create_data(data: DataCreate, session: Session = Depends(get_session)):
-    device = device_crud.get_by_mac(data.device_mac, session)
+@data_routes.get(
+    "/device/{device_mac}/aggregate", response_model=list[DataAggregateResponse]
+)
+async def read_data_aggregate(
+    device_mac: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bucket: TimeBucket = TimeBucket.FIVE_MINUTES,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Per-bucket min/max/avg/count of the sensors and valve ON ratio, computed
+    in the database. Defaults to the last 24 hours.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device Mac not found")
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    start = DateTimeColombia.localize(start) if start else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await data_crud.aggregate(device_mac, start, end, bucket, session)
+
+
+@data_routes.get(
+    "/device/{device_mac}/weather-correlation",
+    response_model=WeatherCorrelationResponse,
+)
+async def read_weather_correlation(
+    device_mac: str,
+    city_name: str = "Medellin",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    tolerance_minutes: int = Query(60, gt=0),
+    max_lag_hours: int = Query(6, ge=0, le=72),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Correlations between the readings of a device and the stored weather of
+    a city, each reading joined to the last observation at most
+    `tolerance_minutes` before it. Lagged correlations compare hourly means
+    of the device `lag_hours` after the weather. Defaults to the last 30 days.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device Mac not found")
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    start = DateTimeColombia.localize(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    result = await weather_correlation(
+        device_mac,
+        city_name,
+        start,
+        end,
+        timedelta(minutes=tolerance_minutes),
+        max_lag_hours,
+        session,
+    )
+    return WeatherCorrelationResponse(
+        device_mac=device_mac, city_name=city_name, start=start, end=end, **result
+    )
+
+
+@data_routes.get("/device/{device_mac}/rollup", response_model=list[DataRollupResponse])
+async def read_data_rollup(
+    device_mac: str,
+    period: RollupPeriod = RollupPeriod.HOUR,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Hourly or daily rollups kept up to date on ingestion, one row per bucket
+    instead of a scan of the raw readings. Defaults to the last 24 hours for
+    hours and the last 30 days for days.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device Mac not found")
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    default_span = timedelta(days=1 if period == RollupPeriod.HOUR else 30)
+    start = DateTimeColombia.localize(start) if start else end - default_span
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await data_crud.get_rollups(device_mac, period, start, end, session)
+
+
+async def _data_batches(device_mac: str | None, start: datetime, end: datetime):
+    # The request session is closed before the body is streamed, so the
+    # stream owns its own session
+    async with async_session_maker() as session:
+        async for rows in data_crud.stream_range(device_mac, start, end, session):
+            yield rows
+
+
+@data_routes.get("/device/{device_mac}/history")
+async def read_data_history(
+    device_mac: str,
+    start: datetime,
+    end: datetime | None = None,
+    stream_format: StreamFormat = Query(StreamFormat.JSON, alias="format"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Streams every reading of the device in [start, end) as a JSON array or
+    NDJSON, ordered by created_at. end defaults to now.
+    """
+    device = await device_registry.get_by_mac(device_mac, session)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device Mac not found")
+    start = DateTimeColombia.localize(start)
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return StreamingResponse(
+        encode_stream(_data_batches(device_mac, start, end), stream_format),
+        media_type=stream_format.media_type,
+    )
+
+
+@data_routes.post("/", response_model=DataResponse | DataAccepted)
+async def create_data(
+    data: DataCreate,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    device = await device_registry.get_by_mac(data.device_mac, session)
     if not device:
         raise HTTPException(status_code=404, detail="Device Mac not found")
-    data_db: DataResponse = data_crud.create(data, session)
+    if ingest_buffer.running:
+        try:
+            await ingest_buffer.put(data)
+        except IngestBufferFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Ingest buffer full",
+                headers={"Retry-After": "1"},
+            )
+        response.status_code = 202
+        return DataAccepted(queued=True, queue_depth=ingest_buffer.queue.qsize())
+    data_db: DataResponse = await data_crud.create(data, session)
     asyncio.create_task(manager.send_data(data_db.model_dump_json(), data.device_mac))
     return data_db
 
 
+@data_routes.post("/batch", response_model=DataBatchResponse)
+async def create_data_batch(
+    data: list[DataCreate], session: AsyncSession = Depends(get_async_session)
+):
+    missing_macs = await device_registry.missing(
+        {obj.device_mac for obj in data}, session
+    )
+    if missing_macs:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Device Mac not found: {', '.join(sorted(missing_macs))}",
+        )
+    rows = await data_crud.create_many(data, session)
+    asyncio.create_task(manager.send_grouped(rows))
+    devices = Counter(row["device_mac"] for row in rows)
+    return DataBatchResponse(inserted=len(rows), devices=devices)
+
+
+@data_routes.get("/buffer/metrics")
+async def read_ingest_buffer_metrics():
+    return ingest_buffer.get_metrics()
+
+
 @data_routes.put("/{data_id}", response_model=DataResponse)
-def update_data(
-    data_id: int, data: DataCreate, session: Session = Depends(get_session)
+async def update_data(
+    data_id: int, data: DataCreate, session: AsyncSession = Depends(get_async_session)
 ):
-    updated_data = data_crud.update(data_id, data, session)
+    updated_data = await data_crud.update(data_id, data, session)
     if updated_data is None:
         raise HTTPException(status_code=404, detail="Data not found")
     return updated_data
 
 
 @data_routes.delete("/{data_id}")
-def delete_data(data_id: int, session: Session = Depends(get_session)):
-    deleted = data_crud.delete(session, data_id)
+async def delete_data(data_id: int, session: AsyncSession = Depends(get_async_session)):
+    deleted = await data_crud.delete(data_id, session)
     if not deleted:
         raise HTTPException(status_code=404, detail="Data not found")
     return {"message": "Data deleted"}
 
 
+@data_routes.websocket("/ws")
+async def websocket_devices(websocket: WebSocket, coalesce_ms: int = Query(0, ge=0)):
+    """
+    One socket for many devices. The client sends control messages
+    {"action": "subscribe" | "unsubscribe", "devices": ["<mac>", ...]},
+    "*" stands for every device. With coalesce_ms the client gets at most the
+    latest message of each device every coalesce_ms milliseconds.
+
+    Messages are a JSON object per reading, or a JSON list of the readings
+    of one device when the ingest buffer writes them in batches.
+    /ws/{device_mac} always gets one object per reading.
+    """
+    subscriber = await manager.accept(websocket, coalesce_ms)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            if data == "disconnect":
+                raise WebSocketDisconnect
+            try:
+                message = SubscriptionMessage.model_validate_json(data)
+            except ValidationError:
+                continue
+            if message.action == SubscriptionAction.SUBSCRIBE:
+                manager.subscribe(subscriber, message.devices)
+            else:
+                manager.unsubscribe(subscriber, message.devices)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.remove(subscriber)
+
+
 @data_routes.websocket("/ws/{device_mac}")
 async def websocket_endpoint(websocket: WebSocket, device_mac: str):
     await manager.connect(websocket, device_mac)
@@ -220,4 +636,6 @@ async def websocket_endpoint(websocket: WebSocket, device_mac: str):
                 raise WebSocketDisconnect
             # Aquí puedes manejar mensajes entrantes si es necesario
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, device_mac)
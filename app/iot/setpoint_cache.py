@@ -0,0 +1,135 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+
+from .broadcast import create_broadcast
+from .crud import device_crud
+from .models import SetpointModel, SetpointResponse
+
+# Device mac of the changes that drop every cached setpoint
+ALL_DEVICES = "*"
+
+
+class SetpointCache:
+    """
+    Latest setpoint per device_mac for the polling devices, with its ETag
+    (setpoint id and updated_at) so unchanged polls can be answered with a
+    304 from memory.
+
+    Entries are kept until a setpoint route changes them. Every change is
+    published on the broadcast backend with the new ETag, empty when the
+    entry is dropped, and each worker drops its entry when the ETag differs.
+    After a reconnect of the backend, changes may have been missed, so the
+    worker clears its entries and asks the other workers to clear theirs.
+
+    A local backend ("memory") does not reach the other workers, so there
+    the entries also expire after `ttl_seconds`.
+    """
+
+    def __init__(self, backend, ttl_seconds: float):
+        self.backend = backend
+        self.backend.attach(self._on_change, resync=self._resync)
+        self.ttl_seconds = ttl_seconds if backend.local else None
+        self.setpoints: Dict[str, Tuple[Optional[SetpointResponse], Optional[str]]] = {}
+        # Monotonic expiry of the entries, only with a local backend
+        self.expires_at: Dict[str, float] = {}
+        # Bumped on every change, a database read that raced with one is
+        # returned but not cached
+        self._generation = 0
+
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def get_last(
+        self, device_mac: str, session: AsyncSession
+    ) -> Optional[SetpointResponse]:
+        setpoint, _ = await self.get_versioned(device_mac, session)
+        return setpoint
+
+    async def get_versioned(
+        self, device_mac: str, session: AsyncSession
+    ) -> Tuple[Optional[SetpointResponse], Optional[str]]:
+        """
+        Latest setpoint of the device and its ETag, (None, None) without one.
+        """
+        entry = self.setpoints.get(device_mac)
+        if entry is None or self._expired(device_mac):
+            generation = self._generation
+            entry = self._version(
+                await device_crud.get_last_setpoint(device_mac, session)
+            )
+            if generation == self._generation:
+                self._store(device_mac, entry)
+        return entry
+
+    async def set(
+        self, device_mac: str, setpoint: Optional[SetpointModel]
+    ) -> Optional[SetpointResponse]:
+        """
+        Stores the new latest setpoint of the device and publishes its ETag.
+        """
+        entry = self._version(setpoint)
+        self._on_change(device_mac, entry[1] or "")
+        self._store(device_mac, entry)
+        await self.backend.publish(device_mac, entry[1] or "")
+        return entry[0]
+
+    async def invalidate(self, device_mac: str):
+        self._on_change(device_mac, "")
+        await self.backend.publish(device_mac, "")
+
+    def _store(
+        self, device_mac: str, entry: Tuple[Optional[SetpointResponse], Optional[str]]
+    ):
+        self.setpoints[device_mac] = entry
+        if self.ttl_seconds is not None:
+            self.expires_at[device_mac] = time.monotonic() + self.ttl_seconds
+
+    def _expired(self, device_mac: str) -> bool:
+        expires_at = self.expires_at.get(device_mac)
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def _version(
+        self, setpoint: Optional[SetpointModel]
+    ) -> Tuple[Optional[SetpointResponse], Optional[str]]:
+        if setpoint is None:
+            return None, None
+        snapshot = SetpointResponse(
+            id=setpoint.id,
+            created_at=setpoint.created_at,
+            setpoint=setpoint.setpoint,
+            device_mac=setpoint.device_mac,
+        )
+        return snapshot, f'"{setpoint.id}-{setpoint.updated_at.timestamp():.6f}"'
+
+    def _on_change(self, device_mac: str, etag: str):
+        if device_mac == ALL_DEVICES:
+            self._generation += 1
+            self.setpoints.clear()
+            self.expires_at.clear()
+            return
+        entry = self.setpoints.get(device_mac)
+        # Our own changes come back with the ETag already stored
+        if entry is not None and (entry[1] or "") == etag:
+            return
+        self._generation += 1
+        self.setpoints.pop(device_mac, None)
+        self.expires_at.pop(device_mac, None)
+
+    async def _resync(self):
+        self._on_change(ALL_DEVICES, "")
+        await self.backend.publish(ALL_DEVICES, "")
+
+
+setpoint_cache = SetpointCache(
+    backend=create_broadcast(
+        settings.BROADCAST_BACKEND, settings.SETPOINT_BROADCAST_CHANNEL
+    ),
+    ttl_seconds=settings.SETPOINT_CACHE_TTL_SECONDS,
+)
@@ -1,30 +1,257 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from enum import Enum
 from typing import Dict, List
 
 from fastapi import WebSocket
+from pydantic_core import to_json
+
+from app.core.config import settings
+
+from .broadcast import create_broadcast
+
+log = logging.getLogger("uvicorn")
+
+
+class SlowConsumerPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+
+
+# Subscribes to every device
+ALL_DEVICES = "*"
+
+
+class Subscriber:
+    """
+    One websocket with its bounded queue of outgoing messages, written by
+    its own task so a slow client only delays itself. Unbatched subscribers
+    (/data/ws/{device_mac}) get one JSON object per row, the grouped lists
+    are split for them.
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.batched = True
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.device_macs: set[str] = set()
+        self.task: asyncio.Task | None = None
+        self.dropped = 0
+
+    def offer(self, message: str, device_mac: str, policy: SlowConsumerPolicy) -> bool:
+        """
+        Queues `message` without waiting. Returns False when the queue is
+        full and the policy is to disconnect the subscriber.
+        """
+        if self.queue.full():
+            if policy == SlowConsumerPolicy.DISCONNECT:
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+        return True
+
+    async def next_messages(self) -> List[str]:
+        return [await self.queue.get()]
+
+
+class CoalescingSubscriber(Subscriber):
+    """
+    Subscriber that gets at most the latest message of each device every
+    `interval_ms`, the older ones are replaced before being sent.
+    """
+
+    def __init__(self, websocket: WebSocket, interval_ms: int):
+        super().__init__(websocket, queue_size=0)
+        self.interval = interval_ms / 1000
+        self.latest: Dict[str, str] = {}
+
+    def offer(self, message: str, device_mac: str, policy: SlowConsumerPolicy) -> bool:
+        if device_mac in self.latest:
+            self.dropped += 1
+        self.latest[device_mac] = message
+        return True
+
+    async def next_messages(self) -> List[str]:
+        await asyncio.sleep(self.interval)
+        messages, self.latest = list(self.latest.values()), {}
+        return messages
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(
+        self,
+        queue_size: int,
+        slow_consumer_policy: SlowConsumerPolicy,
+        send_timeout: float,
+        backend,
+    ):
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self.active_connections: Dict[str, List[Subscriber]] = {}
+        self.backend = backend
+        self.backend.attach(self._deliver)
 
-    async def connect(self, websocket: WebSocket, device_mac: str):
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def accept(self, websocket: WebSocket, coalesce_ms: int = 0) -> Subscriber:
+        """
+        Accepts the websocket and starts its writer, without subscriptions.
+        """
         await websocket.accept()
-        if device_mac not in self.active_connections:
-            self.active_connections[device_mac] = []
-        self.active_connections[device_mac].append(websocket)
+        if coalesce_ms > 0:
+            subscriber = CoalescingSubscriber(websocket, coalesce_ms)
+        else:
+            subscriber = Subscriber(websocket, self.queue_size)
+        subscriber.task = asyncio.create_task(self._writer(subscriber))
+        return subscriber
+
+    def subscribe(self, subscriber: Subscriber, device_macs):
+        for device_mac in device_macs:
+            if device_mac in subscriber.device_macs:
+                continue
+            subscriber.device_macs.add(device_mac)
+            self.active_connections.setdefault(device_mac, []).append(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber, device_macs):
+        for device_mac in device_macs:
+            if device_mac not in subscriber.device_macs:
+                continue
+            subscriber.device_macs.discard(device_mac)
+            subscribers = self.active_connections.get(device_mac)
+            if subscribers and subscriber in subscribers:
+                subscribers.remove(subscriber)
+                if not subscribers:
+                    del self.active_connections[device_mac]
+
+    async def connect(self, websocket: WebSocket, device_mac: str):
+        subscriber = await self.accept(websocket)
+        subscriber.batched = False
+        self.subscribe(subscriber, [device_mac])
+        return subscriber
 
     def disconnect(self, websocket: WebSocket, device_mac: str):
-        if device_mac in self.active_connections:
-            self.active_connections[device_mac].remove(websocket)
-            if not self.active_connections[device_mac]:
-                del self.active_connections[device_mac]
+        subscribers = self.active_connections.get(device_mac, [])
+        for subscriber in subscribers:
+            if subscriber.websocket is websocket:
+                self.remove(subscriber)
+                break
+
+    def remove(self, subscriber: Subscriber):
+        """
+        Drops every subscription of `subscriber` and stops its writer.
+        """
+        self.unsubscribe(subscriber, list(subscriber.device_macs))
+        if (
+            subscriber.task is not None
+            and subscriber.task is not asyncio.current_task()
+        ):
+            subscriber.task.cancel()
+        subscriber.task = None
+
+    async def _writer(self, subscriber: Subscriber):
+        try:
+            while True:
+                for message in await subscriber.next_messages():
+                    await asyncio.wait_for(
+                        subscriber.websocket.send_text(message), self.send_timeout
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"WS: dropping subscriber, send failed {e!r}")
+            self.remove(subscriber)
+            await self._close(subscriber)
+
+    async def _close(self, subscriber: Subscriber):
+        try:
+            await subscriber.websocket.close()
+        except Exception:
+            pass
+
+    def _has_subscribers(self, device_mac: str) -> bool:
+        return (
+            device_mac in self.active_connections
+            or ALL_DEVICES in self.active_connections
+        )
 
     async def send_data(self, data: str, device_mac: str):
-        print("WS Conected")
-        print(self.active_connections)
-        if device_mac in self.active_connections:
-            for connection in self.active_connections[device_mac]:
-                await connection.send_text(data)
+        """
+        Publishes `data` to the subscribers of the device, in every worker
+        when the backend is shared.
+        """
+        await self.backend.publish(device_mac, data)
+
+    async def send_grouped(self, rows: List[dict]):
+        """
+        Sends one message per device containing its rows as a JSON list, or
+        several when the backend limits the message size. Each row is
+        serialized once.
+        """
+        grouped: Dict[str, List[bytes]] = defaultdict(list)
+        for row in rows:
+            if self.backend.local and not self._has_subscribers(row["device_mac"]):
+                continue
+            grouped[row["device_mac"]].append(to_json(row))
+        for device_mac, device_rows in grouped.items():
+            max_bytes = self.backend.max_message_bytes
+            if max_bytes is not None:
+                # Room for the mac and separator the backend adds
+                max_bytes -= len(device_mac) + 1
+            for chunk in _json_lists(device_rows, max_bytes):
+                await self.send_data(chunk, device_mac)
+
+    def _deliver(self, device_mac: str, data: str):
+        """
+        Queues `data` for every local subscriber of the device or of all the
+        devices, without waiting for any socket.
+        """
+        subscribers = {
+            *self.active_connections.get(device_mac, []),
+            *self.active_connections.get(ALL_DEVICES, []),
+        }
+        rows = None
+        for subscriber in subscribers:
+            messages = [data]
+            if not subscriber.batched and data.startswith("["):
+                if rows is None:
+                    rows = [to_json(row).decode() for row in json.loads(data)]
+                messages = rows
+            for message in messages:
+                if not subscriber.offer(message, device_mac, self.slow_consumer_policy):
+                    log.warning(f"WS {device_mac}: disconnecting slow subscriber")
+                    self.remove(subscriber)
+                    asyncio.create_task(self._close(subscriber))
+                    break
+
+
+def _json_lists(items: List[bytes], max_bytes: int | None) -> List[str]:
+    """
+    Joins serialized JSON values into JSON lists of at most max_bytes each.
+    """
+    if max_bytes is None:
+        return [(b"[" + b",".join(items) + b"]").decode()]
+    lists, current, size = [], [], 2
+    for item in items:
+        if current and size + len(item) + 1 > max_bytes:
+            lists.append((b"[" + b",".join(current) + b"]").decode())
+            current, size = [], 2
+        current.append(item)
+        size += len(item) + 1
+    lists.append((b"[" + b",".join(current) + b"]").decode())
+    return lists
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=settings.WS_SEND_QUEUE_SIZE,
+    slow_consumer_policy=SlowConsumerPolicy(settings.WS_SLOW_CONSUMER_POLICY),
+    send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+    backend=create_broadcast(settings.BROADCAST_BACKEND),
+)
@@ -6,10 +6,19 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from iot import DataModel, DeviceModel, SetpointModel, iot_router  # noqa: F401
+from iot.ingest_buffer import ingest_buffer
+from iot.partitions import partition_maintainer, run_maintenance
+from iot.registry import device_registry
+from iot.setpoint_cache import setpoint_cache
+from iot.websocketmanager import manager
 from weather import WeatherAPIModel, api_router  # noqa: F401
+from weather.routers.external_api import weather_poller
+from weather.services.external_api import open_weather_client
+from weather.services.scheduler import weather_scheduler
 
 from app.core.config import settings
-from app.db.configDatabase import init_db
+from app.db.configDatabase import async_session_maker, init_async_db
+from app.utils.pagination import NEXT_CURSOR_HEADER
 
 logging.basicConfig(
     filename="app.log",
@@ -36,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(api_router)
@@ -57,13 +67,53 @@ def home():
 async def startup_event():
     log.info("INIT: ___Starting up___")
     try:
-        init_db()
+        await init_async_db()
     except Exception as e:
         print(f"An exception occurred {e}")
 
+    if settings.DATA_PARTITIONING_ENABLED:
+        try:
+            await run_maintenance()
+        except Exception as e:
+            print(f"An exception occurred creating the data partitions {e}")
+        partition_maintainer.start()
+
+    try:
+        async with async_session_maker() as session:
+            await device_registry.load(session)
+        log.info(f"INIT: {len(device_registry.devices)} devices loaded")
+    except Exception as e:
+        print(f"An exception occurred loading the device registry {e}")
+    device_registry.start()
+
+    try:
+        await manager.start()
+    except Exception as e:
+        log.error(f"An exception occurred starting the broadcast backend {e}")
+    try:
+        await setpoint_cache.start()
+    except Exception as e:
+        log.error(f"An exception occurred starting the setpoint broadcast {e}")
+
+    if settings.INGEST_BUFFER_ENABLED:
+        ingest_buffer.start()
+
     log.info("INIT: ___end___")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    log.info("SHUTDOWN: ___flushing ingest buffer___")
+    await ingest_buffer.stop()
+    await device_registry.stop()
+    await partition_maintainer.stop()
+    await manager.stop()
+    await setpoint_cache.stop()
+    await weather_poller.stop()
+    await weather_scheduler.stop()
+    await open_weather_client.aclose()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
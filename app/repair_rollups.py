@@ -0,0 +1,40 @@
+# repair_rollups.py
+"""
+Rebuilds the hourly and daily rollups of a window of days from the raw
+readings. Days whose raw readings were already dropped are left as they are.
+
+Usage:
+    python repair_rollups.py --start 2024-01-01 [--end 2024-01-31]
+        [--device-mac 00:1B:44:11:3A:B7]
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import date
+
+from iot.rollups import rebuild_days
+
+from app.db.configDatabase import async_engine
+from app.utils.data_time_zone import DateTimeColombia
+
+
+async def repair(args) -> int:
+    last_day = args.end or DateTimeColombia.today()
+    async with async_engine.begin() as conn:
+        days = await rebuild_days(conn, args.start, last_day, args.device_mac)
+    await async_engine.dispose()
+    print(f"Rollups rebuilt for {len(days)} days between {args.start} and {last_day}")
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Rebuild the rollups from raw data")
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, help="defaults to today")
+    parser.add_argument("--device-mac", help="only this device")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(repair(parse_args(sys.argv[1:]))))
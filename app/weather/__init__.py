@@ -1,7 +1,5 @@
 from fastapi import APIRouter
 
-from app.utils.base_crud import BaseCRUD  # noqa: F401
-
 from .models import WeatherAPIModel, WeatherModel  # noqa: F401
 from .routers import api_routers  # noqa: F401
 
@@ -1,17 +1,63 @@
-from app.utils.base_crud import BaseCRUD
+from datetime import datetime
+from typing import AsyncIterator
 
-from .models import WeatherAPIModel, WeatherModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.utils.base_crud import AsyncBaseCRUD
+from app.utils.time_bucket import TimeBucket, aggregate_by_bucket
 
-class WeatherCRUD(BaseCRUD):
+from .models import SERIES_COLUMNS, WeatherAPIModel, WeatherModel
+
+
+class WeatherCRUD(AsyncBaseCRUD):
     model = WeatherModel
 
 
 weather_crud = WeatherCRUD()
 
 
-class WeatherAPICRUD(BaseCRUD):
+class WeatherAPICRUD(AsyncBaseCRUD):
     model = WeatherAPIModel
 
+    def stream_range(
+        self,
+        city_name: str | None,
+        start: datetime,
+        end: datetime,
+        session: AsyncSession,
+    ) -> AsyncIterator[list[dict]]:
+        """
+        Observations in [start, end), of one city or of all when city_name is
+        None, streamed in batches of dicts.
+        """
+        filters = [self.model.created_at >= start, self.model.created_at < end]
+        if city_name is not None:
+            filters.append(self.model.city_name == city_name)
+        return self.stream(session, *filters)
+
+    async def history(
+        self,
+        city_name: str,
+        start: datetime,
+        end: datetime,
+        bucket: TimeBucket,
+        session: AsyncSession,
+    ) -> list[dict]:
+        """
+        min/max/avg/count of the weather series of a city per time bucket,
+        over the (city_name, created_at) index.
+        """
+        return await aggregate_by_bucket(
+            session,
+            self.model.created_at,
+            [
+                self.model.city_name == city_name,
+                self.model.created_at >= start,
+                self.model.created_at < end,
+            ],
+            bucket,
+            series={name: getattr(self.model, name) for name in SERIES_COLUMNS},
+        )
+
 
 weather_api_crud = WeatherAPICRUD()
@@ -2,15 +2,20 @@ from datetime import date, datetime
 from typing import List, Optional
 
 from pydantic import BaseModel
-from sqlmodel import Field, SQLModel
+from sqlalchemy import DateTime
+from sqlmodel import Field, Index, SQLModel
 
 from app.utils.data_time_zone import DateTimeColombia
 
 
 class BaseTableModel(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=DateTimeColombia.now)
-    updated_at: datetime = Field(default_factory=DateTimeColombia.now)
+    created_at: datetime = Field(
+        default_factory=DateTimeColombia.now, sa_type=DateTime(timezone=True)
+    )
+    updated_at: datetime = Field(
+        default_factory=DateTimeColombia.now, sa_type=DateTime(timezone=True)
+    )
     created_date: date = Field(default_factory=DateTimeColombia.today)
 
 
@@ -42,8 +47,31 @@ class WeatherAPIResponse(BaseModel):
     country: str
 
 
+# Columns summarized by the history endpoint
+SERIES_COLUMNS = ("temperature", "humidity", "pressure", "wind_speed")
+
+
 class WeatherAPIModel(BaseTableModel, WeatherAPIResponse, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_weatherapimodel_city_name_created_at", "city_name", "created_at"),
+    )
+
+
+class WeatherHistoryResponse(BaseModel):
+    bucket_start: datetime
+    count: int
+    temperature_min: float
+    temperature_max: float
+    temperature_avg: float
+    humidity_min: float
+    humidity_max: float
+    humidity_avg: float
+    pressure_min: float
+    pressure_max: float
+    pressure_avg: float
+    wind_speed_min: float
+    wind_speed_max: float
+    wind_speed_avg: float
 
 
 ###########
@@ -52,6 +80,29 @@ class LocationParams(SQLModel):
     country_code: str | None = Field(default="")
     state_code: str | None = Field(default="")
 
+    def key(self) -> tuple[str, str, str]:
+        """
+        Normalized (city, state, country) identifying the location.
+        """
+        return (
+            self.city_name.strip().lower(),
+            (self.state_code or "").strip().lower(),
+            (self.country_code or "").strip().lower(),
+        )
+
+
+class WeatherLocation(LocationParams):
+    # Polling interval of this location, the scheduler default when None
+    interval_seconds: float | None = None
+
+
+class GridCell(SQLModel):
+    # Geohash of the cell, its weather is fetched at the cell center
+    geohash: str
+
+    def key(self) -> tuple[str]:
+        return (self.geohash,)
+
 
 class Coord(SQLModel):
     lon: float
@@ -1,18 +1,27 @@
-import asyncio
+from datetime import datetime, timedelta
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
     WebSocket,
     WebSocketDisconnect,
 )
+from fastapi.responses import StreamingResponse
 
 # from fastapi.datastructures import QueryParams
-from sqlmodel import Session
-from weather.services.external_api import fetch_weather_data
-
-from app.db.configDatabase import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from weather.services.cache import weather_cache
+from weather.services.dedup import observation_dedup
+from weather.services.external_api import create_weather_api_response
+from weather.services.poller import WeatherPoller
+from weather.services.scheduler import weather_scheduler
+
+from app.db.configDatabase import async_session_maker, get_async_session
+from app.utils.data_time_zone import DateTimeColombia
+from app.utils.export import ExportFormat, export_stream, pyarrow_available
+from app.utils.time_bucket import TimeBucket
 
 from ..crud import weather_api_crud
 from ..models import (
@@ -20,41 +29,25 @@ from ..models import (
     WeatherAPIModel,
     WeatherAPIResponse,
     WeatherData,
+    WeatherHistoryResponse,
 )
 
 api_routers = APIRouter(prefix="/api", tags=["external-api"])
 
 # Constants
-DEFAULT_CITY_NAME = "Medellin"
 BACKGROUND_TASK_SLEEP_DURATION = 10  # in seconds
 
 
 # Helper Functions
 async def fetch_and_validate_weather_data(location_params: LocationParams):
-    data = fetch_weather_data(**location_params.model_dump())
+    data = await weather_cache.get(location_params)
+    if data is None:
+        raise HTTPException(status_code=503, detail="Weather service unavailable")
     if "cod" in data and data["cod"] == "404":
         raise HTTPException(status_code=404, detail="City not found")
     return data
 
 
-def create_weather_api_response(data) -> WeatherAPIResponse:
-    return WeatherAPIResponse(
-        city_name=data["name"],
-        city_id=str(data["id"]),
-        temperature=data["main"]["temp"],
-        pressure=data["main"]["pressure"],
-        description=data["weather"][0]["description"],
-        icon=data["weather"][0]["icon"],
-        lon=data["coord"]["lon"],
-        lat=data["coord"]["lat"],
-        weather_api_id=str(data["weather"][0]["id"]),
-        humidity=data["main"]["humidity"],
-        wind_speed=data["wind"]["speed"],
-        wind_deg=data["wind"]["deg"],
-        country=data["sys"]["country"],
-    )
-
-
 # Routes
 @api_routers.post("/data/raw", response_model=WeatherData)
 async def get_weather_data_raw_from_api(location_params: LocationParams):
@@ -94,29 +87,38 @@ async def get_weather_data_from_api():
 
 @api_routers.post("/data", response_model=WeatherAPIModel)
 async def store_weather_data(
-    weather_api: WeatherAPIResponse, session: Session = Depends(get_session)
+    weather_api: WeatherAPIResponse,
+    session: AsyncSession = Depends(get_async_session),
 ):
     """
     Stores weather data in the database.
 
     Args:
         weather_api (WeatherAPIResponse): Weather data to be stored.
-        session (Session): Database session.
+        session (AsyncSession): Database session.
 
     Returns:
-        WeatherAPIModel: Weather data stored in the database.
+        WeatherAPIModel: Weather data stored in the database, or the row
+            already stored when the observation has not changed.
     """
-    return weather_api_crud.create(weather_api, session)
+    stored = observation_dedup.find_duplicate(weather_api)
+    if stored is not None:
+        return stored
+    stored = await weather_api_crud.create(weather_api, session)
+    observation_dedup.remember(weather_api, stored)
+    return stored
 
 
 @api_routers.get("/data/{id}", response_model=WeatherAPIModel)
-async def get_weather_data_by_id(id: int, session: Session = Depends(get_session)):
+async def get_weather_data_by_id(
+    id: int, session: AsyncSession = Depends(get_async_session)
+):
     """
     Retrieves weather data by ID from the database.
 
     Args:
         id (int): ID of the weather data to retrieve.
-        session (Session): Database session.
+        session (AsyncSession): Database session.
 
     Returns:
         WeatherAPIModel: Weather data retrieved from the database.
@@ -124,55 +126,127 @@ async def get_weather_data_by_id(id: int, session: Session = Depends(get_session
     Raises:
         HTTPException: If the weather data with the specified ID is not found.
     """
-    weather_api = weather_api_crud.get_by_id(id, session=session)
+    weather_api = await weather_api_crud.get_by_id(id, session=session)
 
     if weather_api is None:
         raise HTTPException(status_code=404, detail="City weather data not found")
     return weather_api
 
 
-# Background Task
-background_task = None
+async def _weather_batches(city_name: str | None, start: datetime, end: datetime):
+    # The request has no session to lend, the stream owns its own
+    async with async_session_maker() as session:
+        async for rows in weather_api_crud.stream_range(city_name, start, end, session):
+            yield rows
 
 
-async def background_task_function(session):
+@api_routers.get("/export")
+async def export_weather_data(
+    start: datetime,
+    end: datetime | None = None,
+    city_name: str | None = None,
+    export_format: ExportFormat = Query(ExportFormat.CSV, alias="format"),
+):
     """
-    Background task function that continuously fetches weather data for a specific city and stores it in the database.
+    Streams the stored weather observations in a time range.
 
     Args:
-        session (Session): Database session.
+        start (datetime): Start of the range (inclusive).
+        end (datetime, optional): End of the range (exclusive), defaults to now.
+        city_name (str, optional): Only this city, all cities when omitted.
+        export_format (ExportFormat): csv, ndjson, arrow or parquet.
 
     Returns:
-        None
+        StreamingResponse: The export file, built in column batches.
+
+    Raises:
+        HTTPException: If the range is empty or the format needs pyarrow.
+    """
+    if export_format.requires_pyarrow and not pyarrow_available():
+        raise HTTPException(
+            status_code=400, detail=f"{export_format.value} export requires pyarrow"
+        )
+    start = DateTimeColombia.localize(start)
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    filename = f"weather_{city_name or 'all'}_{start:%Y%m%d}_{end:%Y%m%d}"
+    return StreamingResponse(
+        export_stream(
+            _weather_batches(city_name, start, end),
+            export_format,
+            weather_api_crud.model,
+        ),
+        media_type=export_format.media_type,
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{filename}.{export_format.value}"'
+            )
+        },
+    )
+
+
+@api_routers.get("/history", response_model=list[WeatherHistoryResponse])
+async def get_weather_history(
+    city: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bucket: TimeBucket = TimeBucket.ONE_HOUR,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Downsampled weather history of a city, computed in the database.
+
+    Args:
+        city (str): City name as stored from the API response.
+        start (datetime, optional): Start of the range (inclusive), defaults
+            to 7 days before end.
+        end (datetime, optional): End of the range (exclusive), defaults to now.
+        bucket (TimeBucket): Size of the buckets, 1m, 5m, 1h or 1d.
+
+    Returns:
+        list[WeatherHistoryResponse]: min/max/avg of the temperature,
+            humidity, pressure and wind speed per bucket, empty buckets
+            omitted.
+
+    Raises:
+        HTTPException: If the range is empty.
+    """
+    end = DateTimeColombia.localize(end) if end else DateTimeColombia.now()
+    start = DateTimeColombia.localize(start) if start else end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await weather_api_crud.history(city, start, end, bucket, session)
+
+
+@api_routers.get("/metrics")
+async def get_weather_metrics():
     """
-    while True:
-        try:
-            data = fetch_weather_data(city_name=DEFAULT_CITY_NAME)
-            if "cod" in data and data["cod"] == "404":
-                print("Background Task: City not found")
-                continue
-            weather_api = create_weather_api_response(data)
-            weather_api_crud.create(weather_api, session)
-            print("Background Task: Data stored")
-        except Exception as e:
-            print(f"An error occurred Background Task: {e}")
-        await asyncio.sleep(BACKGROUND_TASK_SLEEP_DURATION)
+    Counters of the weather ingestion.
+
+    Returns:
+        dict: Scheduler cycles, observations stored and skipped as
+            duplicates, and the hits and misses of the weather cache.
+    """
+    return {
+        "scheduler": weather_scheduler.metrics,
+        "observations": observation_dedup.metrics,
+        "cache": weather_cache.metrics,
+    }
 
 
 @api_routers.post("/start")
-async def start_background_task(session: Session = Depends(get_session)):
+async def start_background_task():
     """
     Endpoint to start the background task for fetching and storing weather data.
 
-    Args:
-        session (Session): Database session.
+    The task polls every location of WEATHER_LOCATIONS, see WeatherScheduler.
 
     Returns:
         dict: Message indicating the status of the background task.
     """
-    global background_task
-    if background_task is None:
-        background_task = asyncio.create_task(background_task_function(session))
+    if not weather_scheduler.running:
+        weather_scheduler.start()
         return {"message": "Background task started"}
     else:
         return {"message": "Background task is already running"}
@@ -186,21 +260,30 @@ async def stop_background_task():
     Returns:
         dict: Message indicating the status of the background task.
     """
-    global background_task
-    if background_task is not None:
-        background_task.cancel()
-        background_task = None
+    if weather_scheduler.running:
+        await weather_scheduler.stop()
         return {"message": "Background task stopped"}
     else:
         return {"message": "No background task is currently running"}
 
 
+# One upstream poll per location, shared by every websocket viewer
+weather_poller = WeatherPoller(
+    interval_seconds=BACKGROUND_TASK_SLEEP_DURATION,
+    parse=lambda data: create_weather_api_response(data).model_dump(),
+    cache=weather_cache,
+)
+
+
 # WebSocket endpoint to view data similar to GET /api/data
 @api_routers.websocket("/ws/data/")
 async def websocket_endpoint(websocket: WebSocket):
     """
     WebSocket endpoint to view weather data in real-time.
 
+    All the viewers of a location share one poller, a new viewer gets the
+    last known value right away.
+
     Args:
         websocket (WebSocket): WebSocket connection.
 
@@ -212,14 +295,14 @@ async def websocket_endpoint(websocket: WebSocket):
     """
     await websocket.accept()
     location_params = LocationParams()
-    while True:
-        try:
-            data = await fetch_and_validate_weather_data(location_params)
-            weather_response = create_weather_api_response(data).model_dump()
+    queue = weather_poller.subscribe(location_params)
+    try:
+        while True:
+            weather_response = await queue.get()
             await websocket.send_json(weather_response)
-            await asyncio.sleep(BACKGROUND_TASK_SLEEP_DURATION)
-        except WebSocketDisconnect:
-            break
-        except HTTPException as e:
-            await websocket.send_json({"error": e.detail})
-            break
+            if "error" in weather_response:
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        weather_poller.unsubscribe(location_params, queue)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+from app.core.config import settings
+
+from ..models import LocationParams
+from .external_api import fetch_weather_by_cell, fetch_weather_data
+
+log = logging.getLogger("uvicorn")
+
+
+class WeatherCache:
+    """
+    Cache of upstream weather responses keyed on the normalized
+    LocationParams (or any model with a `key()`, such as a GridCell).
+
+    Entries younger than `ttl_seconds` are served as they are. Until
+    `ttl_seconds + stale_seconds` they are still served while a background
+    refresh runs (stale-while-revalidate), older ones are fetched again.
+    Concurrent refreshes of one location share a single upstream call
+    (single-flight).
+
+    Args:
+        fetch (Callable): Coroutine function taking the location fields
+            and returning the upstream JSON, or None on failure.
+        ttl_seconds (float): Freshness of an entry.
+        stale_seconds (float): Extra time an entry can be served stale.
+        max_entries (int): Least recently used entries beyond this are evicted.
+        clock (Callable, optional): Time source, monotonic by default.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[..., Awaitable[dict | None]],
+        ttl_seconds: float,
+        stale_seconds: float,
+        max_entries: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries: OrderedDict[tuple, tuple[dict, float]] = OrderedDict()
+        self.inflight: Dict[tuple, asyncio.Task] = {}
+        self.metrics = {"hits": 0, "stale_hits": 0, "misses": 0, "upstream_calls": 0}
+
+    async def get(
+        self, location_params: LocationParams, max_age: float | None = None
+    ) -> dict | None:
+        """
+        Weather of the location, or None when upstream failed. With
+        `max_age`, entries older than that are fetched again (through the
+        shared call) instead of being served, fresh or stale.
+        """
+        key = location_params.key()
+        entry = self.entries.get(key)
+        if entry is not None:
+            data, fetched_at = entry
+            age = self.clock() - fetched_at
+            if age < self.ttl_seconds and (max_age is None or age < max_age):
+                self.metrics["hits"] += 1
+                self.entries.move_to_end(key)
+                return data
+            if max_age is None and age < self.ttl_seconds + self.stale_seconds:
+                self.metrics["stale_hits"] += 1
+                self._refresh(key, location_params)
+                return data
+        self.metrics["misses"] += 1
+        # Shielded so a cancelled request does not cancel the shared call
+        return await asyncio.shield(self._refresh(key, location_params))
+
+    def invalidate(self, location_params: LocationParams):
+        self.entries.pop(location_params.key(), None)
+
+    def _refresh(self, key: tuple, location_params: LocationParams) -> asyncio.Task:
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, location_params))
+            self.inflight[key] = task
+        return task
+
+    async def _fetch(self, key: tuple, location_params: LocationParams):
+        try:
+            self.metrics["upstream_calls"] += 1
+            data = await self.fetch(**location_params.model_dump())
+            if data is not None:
+                self.entries[key] = (data, self.clock())
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return data
+        except Exception as e:
+            log.error(f"Weather cache: refresh of {key} failed {e}")
+            return None
+        finally:
+            del self.inflight[key]
+
+
+weather_cache = WeatherCache(
+    fetch=fetch_weather_data,
+    ttl_seconds=settings.WEATHER_CACHE_TTL_SECONDS,
+    stale_seconds=settings.WEATHER_CACHE_STALE_SECONDS,
+    max_entries=settings.WEATHER_CACHE_MAX_ENTRIES,
+)
+
+# Weather of the geohash cells holding devices, shared by all their devices
+cell_weather_cache = WeatherCache(
+    fetch=fetch_weather_by_cell,
+    ttl_seconds=settings.WEATHER_CACHE_TTL_SECONDS,
+    stale_seconds=settings.WEATHER_CACHE_STALE_SECONDS,
+    max_entries=settings.WEATHER_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,59 @@
+import time
+from typing import Any, Dict
+
+from app.core.config import settings
+
+from ..models import WeatherAPIResponse
+
+
+class ObservationDeduplicator:
+    """
+    Last stored observation of each city (by upstream city_id), to skip
+    writing an observation that has not changed.
+
+    An observation is a duplicate when its values equal the last stored ones
+    and its upstream timestamp `dt` is the same, or unknown on either side
+    (POST /api/data does not carry it). Once `max_interval_seconds` have
+    passed since the last stored one, the observation is stored again, so a
+    steady city still gets a row at least that often. The map lives in the
+    process memory.
+    """
+
+    def __init__(self, max_interval_seconds: float):
+        self.max_interval_seconds = max_interval_seconds
+        self.last: Dict[str, tuple[int | None, dict, Any, float]] = {}
+        self.metrics = {"stored": 0, "duplicates": 0}
+
+    def find_duplicate(self, observation: WeatherAPIResponse, dt: int | None = None):
+        """
+        The stored row `observation` duplicates, or None when it is new. A
+        duplicate is counted in the metrics.
+        """
+        previous = self.last.get(observation.city_id)
+        if previous is None:
+            return None
+        previous_dt, values, row, stored_at = previous
+        if time.monotonic() - stored_at >= self.max_interval_seconds:
+            return None
+        same_dt = dt is None or previous_dt is None or dt == previous_dt
+        if same_dt and values == observation.model_dump():
+            self.metrics["duplicates"] += 1
+            return row
+        return None
+
+    def remember(self, observation: WeatherAPIResponse, row, dt: int | None = None):
+        """
+        Records `observation` as the last one stored for its city, as `row`.
+        """
+        self.last[observation.city_id] = (
+            dt,
+            observation.model_dump(),
+            row,
+            time.monotonic(),
+        )
+        self.metrics["stored"] += 1
+
+
+observation_dedup = ObservationDeduplicator(
+    max_interval_seconds=settings.WEATHER_DEDUP_MAX_INTERVAL_SECONDS
+)
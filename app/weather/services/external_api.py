@@ -1,11 +1,188 @@
-import requests
+import asyncio
+import logging
+import random
+import time
+
+import httpx
 
 from app.core.config import settings
+from app.utils import geohash as geohash_utils
+
+from ..models import WeatherAPIResponse
+
+log = logging.getLogger("uvicorn")
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects
+    calls for `reset_timeout` seconds, then lets a single probe call through
+    (half-open): its success closes it, its failure reopens it right away.
+    The other calls are rejected while the probe is in flight.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return (
+            self.opened_at is not None
+            and time.monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.is_open or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def release(self):
+        """
+        Ends the half-open probe let through by allow(), whatever its outcome.
+        """
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class OpenWeatherClient:
+    """
+    Async OpenWeatherMap client sharing one pooled keep-alive connection
+    pool, with connect/read timeouts, retries with jittered exponential
+    backoff on network errors and 5xx responses, and a circuit breaker.
+
+    Args:
+        base_url (str): Weather endpoint, e.g. a local stub server in tests.
+        api_key (str): OpenWeatherMap API key.
+        timeout (httpx.Timeout): Connect/read/write/pool timeouts.
+        max_retries (int): Retries after the first attempt.
+        backoff (float): Base of the exponential backoff, in seconds.
+        breaker (CircuitBreaker): Breaker shared by all the calls.
+        limits (httpx.Limits, optional): Connection pool limits.
+        transport (httpx.AsyncBaseTransport, optional): Custom transport.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        timeout: httpx.Timeout,
+        max_retries: int,
+        backoff: float,
+        breaker: CircuitBreaker,
+        limits: httpx.Limits | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker
+        self.limits = limits or httpx.Limits()
+        self.transport = transport
+        self.client: httpx.AsyncClient | None = None
+
+    def _client(self) -> httpx.AsyncClient:
+        # Created on first use so it belongs to the running event loop
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout, limits=self.limits, transport=self.transport
+            )
+        return self.client
 
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
 
-def fetch_weather_data(
+    async def get(self, params: dict) -> dict | None:
+        """
+        GET base_url with `params` and the API key.
+
+        Returns:
+            dict: The JSON body, also for a 404 ({"cod": "404", ...}).
+            None: If the breaker is open, on another 4xx or when the retries
+                are exhausted.
+        """
+        # Allowed while opened, this call is the half-open probe
+        probe = self.breaker.opened_at is not None
+        if not self.breaker.allow():
+            log.warning("OpenWeather: circuit open, request skipped")
+            return None
+        try:
+            return await self._get({**params, "appid": self.api_key})
+        finally:
+            if probe:
+                self.breaker.release()
+
+    async def _get(self, params: dict) -> dict | None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._client().get(self.base_url, params=params)
+            except httpx.TransportError as e:
+                log.warning(f"OpenWeather: {e!r} (attempt {attempt + 1})")
+            else:
+                if response.status_code >= 500:
+                    log.warning(
+                        f"OpenWeather: HTTP {response.status_code} "
+                        f"(attempt {attempt + 1})"
+                    )
+                elif response.status_code == 404 or response.is_success:
+                    try:
+                        body = response.json()
+                    except ValueError as e:
+                        # A proxy error page or a truncated body
+                        log.warning(
+                            f"OpenWeather: invalid JSON {e} (attempt {attempt + 1})"
+                        )
+                    else:
+                        self.breaker.record_success()
+                        return body
+                else:
+                    self.breaker.record_success()
+                    log.error(f"OpenWeather: HTTP {response.status_code}")
+                    return None
+            if attempt < self.max_retries:
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        self.breaker.record_failure()
+        return None
+
+
+open_weather_client = OpenWeatherClient(
+    base_url=settings.OPEN_WEATHER_BASE_URL,
+    api_key=settings.OPEN_WEATHER_API_KEY,
+    timeout=httpx.Timeout(
+        settings.OPEN_WEATHER_READ_TIMEOUT_SECONDS,
+        connect=settings.OPEN_WEATHER_CONNECT_TIMEOUT_SECONDS,
+    ),
+    max_retries=settings.OPEN_WEATHER_MAX_RETRIES,
+    backoff=settings.OPEN_WEATHER_RETRY_BACKOFF_SECONDS,
+    breaker=CircuitBreaker(
+        failure_threshold=settings.OPEN_WEATHER_BREAKER_FAILURES,
+        reset_timeout=settings.OPEN_WEATHER_BREAKER_RESET_SECONDS,
+    ),
+    limits=httpx.Limits(max_connections=settings.OPEN_WEATHER_MAX_CONNECTIONS),
+)
+
+
+async def fetch_weather_data(
     city_name: str, country_code: str = None, state_code: str = None
-) -> dict:
+) -> dict | None:
     """
     Fetches weather data for a specific city using the OpenWeatherMap API.
 
@@ -16,14 +193,13 @@ def fetch_weather_data(
 
     Returns:
         dict: A dictionary containing the weather data for the specified city.
+        None: If the API could not be reached.
 
     error message ={
     "cod": "404",
     "message": "city not found"
     }
     """
-    base_url = "https://api.openweathermap.org/data/2.5/weather"
-
     if state_code and country_code:
         query_params = f"{city_name},{state_code},{country_code}"
     elif country_code:
@@ -31,26 +207,39 @@ def fetch_weather_data(
     else:
         query_params = city_name
 
-    params = {
-        "q": query_params,
-        "appid": settings.OPEN_WEATHER_API_KEY,
-        "units": "metric",
-    }
+    return await open_weather_client.get({"q": query_params, "units": "metric"})
+
+
+async def fetch_weather_by_cell(geohash: str) -> dict | None:
+    """
+    Fetches the weather at the center of a geohash cell.
+
+    Args:
+        geohash (str): The geohash of the cell.
+
+    Returns:
+        dict: A dictionary containing the weather data for the cell.
+        None: If the API could not be reached.
+    """
+    latitude, longitude = geohash_utils.decode(geohash)
+    return await open_weather_client.get(
+        {"lat": round(latitude, 4), "lon": round(longitude, 4), "units": "metric"}
+    )
 
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()  # Raises a HTTPError if the status is 4xx, 5xx
-    except requests.exceptions.HTTPError as errh:
-        print ("HTTP Error:",errh)
-        return None
-    except requests.exceptions.ConnectionError as errc:
-        print ("Error Connecting:",errc)
-        return None
-    except requests.exceptions.Timeout as errt:
-        print ("Timeout Error:",errt)
-        return None
-    except requests.exceptions.RequestException as err:
-        print ("Something went wrong with the request:",err)
-        return None
 
-    return response.json()
+def create_weather_api_response(data) -> WeatherAPIResponse:
+    return WeatherAPIResponse(
+        city_name=data["name"],
+        city_id=str(data["id"]),
+        temperature=data["main"]["temp"],
+        pressure=data["main"]["pressure"],
+        description=data["weather"][0]["description"],
+        icon=data["weather"][0]["icon"],
+        lon=data["coord"]["lon"],
+        lat=data["coord"]["lat"],
+        weather_api_id=str(data["weather"][0]["id"]),
+        humidity=data["main"]["humidity"],
+        wind_speed=data["wind"]["speed"],
+        wind_deg=data["wind"]["deg"],
+        country=data["sys"]["country"],
+    )
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Set
+
+from ..models import LocationParams
+from .cache import WeatherCache
+
+log = logging.getLogger("uvicorn")
+
+
+class LocationFeed:
+    """
+    Polling task of one location and the queues of its subscribers.
+    """
+
+    def __init__(self, location_params: LocationParams):
+        self.location_params = location_params
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.latest: dict | None = None
+        self.task: asyncio.Task | None = None
+
+    def publish(self, message: dict):
+        self.latest = message
+        for queue in self.subscribers:
+            # Viewers only care about the newest value
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+class WeatherPoller:
+    """
+    Polls OpenWeather once per location every `interval_seconds`, whatever
+    the number of viewers, and broadcasts the parsed WeatherAPIResponse to
+    the subscribers of that location. A location is polled only while it has
+    subscribers.
+
+    Polls go through `cache` asking for data at most `interval_seconds` old,
+    so they share the upstream calls and the entries of the HTTP routes.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float,
+        parse: Callable[[dict], dict],
+        cache: WeatherCache,
+    ):
+        self.interval_seconds = interval_seconds
+        self.parse = parse
+        self.cache = cache
+        self.feeds: Dict[tuple, LocationFeed] = {}
+
+    def subscribe(self, location_params: LocationParams) -> asyncio.Queue:
+        """
+        Queue receiving the weather of the location, starting with the last
+        known value when there is one.
+        """
+        key = location_params.key()
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = LocationFeed(location_params)
+            feed.task = asyncio.create_task(self._run(feed))
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if feed.latest is not None:
+            queue.put_nowait(feed.latest)
+        feed.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, location_params: LocationParams, queue: asyncio.Queue):
+        key = location_params.key()
+        feed = self.feeds.get(key)
+        if feed is None:
+            return
+        feed.subscribers.discard(queue)
+        if not feed.subscribers:
+            feed.task.cancel()
+            del self.feeds[key]
+
+    async def stop(self):
+        for feed in self.feeds.values():
+            feed.task.cancel()
+        self.feeds = {}
+
+    async def _run(self, feed: LocationFeed):
+        while True:
+            try:
+                data = await self.cache.get(
+                    feed.location_params, max_age=self.interval_seconds
+                )
+                if data and data.get("cod") in ("404", 404):
+                    feed.publish({"error": "City not found"})
+                elif data:
+                    feed.publish(self.parse(data))
+            except Exception as e:
+                log.error(f"Weather poller: {feed.location_params.city_name} {e}")
+            await asyncio.sleep(self.interval_seconds)
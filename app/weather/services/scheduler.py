@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import List
+
+from app.core.config import settings
+from app.db.configDatabase import async_session_maker
+
+from ..crud import weather_api_crud
+from ..models import WeatherLocation
+from .dedup import observation_dedup
+from .external_api import create_weather_api_response, fetch_weather_data
+
+log = logging.getLogger("uvicorn")
+
+
+class WeatherScheduler:
+    """
+    Polls many locations from a single task. Each location is due every
+    `interval_seconds` (its own or the default) plus a random jitter, the
+    due locations are fetched together with at most `max_concurrency`
+    upstream calls in flight, and the new observations of a cycle (see
+    ObservationDeduplicator) are stored with one bulk insert in a session of
+    their own.
+
+    Args:
+        locations (List[WeatherLocation]): Locations to poll.
+        default_interval (float): Interval of the locations without one.
+        jitter (float): Up to this many seconds are added to each interval.
+        max_concurrency (int): Upstream calls in flight at once.
+    """
+
+    def __init__(
+        self,
+        locations: List[WeatherLocation],
+        default_interval: float,
+        jitter: float,
+        max_concurrency: int,
+    ):
+        self.locations = locations
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.task: asyncio.Task | None = None
+        self.metrics = {"cycles": 0, "fetched": 0, "stored": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        # The loop ends by itself when there are no locations
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        if not self.running:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _interval(self, location: WeatherLocation) -> float:
+        interval = location.interval_seconds or self.default_interval
+        return interval + random.uniform(0, self.jitter)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        now = time.monotonic()
+        # Spread the first polls over one jitter window
+        due = [
+            (now + random.uniform(0, self.jitter), i)
+            for i in range(len(self.locations))
+        ]
+        heapq.heapify(due)
+        while due:
+            await asyncio.sleep(max(0.0, due[0][0] - time.monotonic()))
+            now = time.monotonic()
+            indexes = []
+            while due and due[0][0] <= now:
+                indexes.append(heapq.heappop(due)[1])
+            try:
+                await self._cycle([self.locations[i] for i in indexes], semaphore)
+            except Exception as e:
+                log.error(f"Weather scheduler: cycle failed {e}")
+            now = time.monotonic()
+            for i in indexes:
+                heapq.heappush(due, (now + self._interval(self.locations[i]), i))
+
+    async def _cycle(self, locations: List[WeatherLocation], semaphore):
+        async def fetch(location: WeatherLocation):
+            async with semaphore:
+                return await fetch_weather_data(
+                    **location.model_dump(exclude={"interval_seconds"})
+                )
+
+        # One failing location must not cost the others their insert
+        results = await asyncio.gather(
+            *(fetch(location) for location in locations), return_exceptions=True
+        )
+        responses, dts = [], []
+        for location, data in zip(locations, results):
+            if isinstance(data, Exception):
+                self.metrics["failed"] += 1
+                log.error(f"Weather scheduler: {location.city_name} failed {data}")
+                continue
+            if data is None or data.get("cod") in ("404", 404):
+                self.metrics["failed"] += 1
+                log.warning(f"Weather scheduler: no data for {location.city_name}")
+                continue
+            try:
+                response = create_weather_api_response(data)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                self.metrics["failed"] += 1
+                log.error(f"Weather scheduler: bad data for {location.city_name} {e}")
+                continue
+            self.metrics["fetched"] += 1
+            if observation_dedup.find_duplicate(response, data.get("dt")) is None:
+                responses.append(response)
+                dts.append(data.get("dt"))
+        self.metrics["cycles"] += 1
+        if responses:
+            async with async_session_maker() as session:
+                rows = await weather_api_crud.create_many(responses, session)
+            for response, dt, row in zip(responses, dts, rows):
+                observation_dedup.remember(response, row, dt)
+            self.metrics["stored"] += len(responses)
+
+
+weather_scheduler = WeatherScheduler(
+    locations=[WeatherLocation(**location) for location in settings.WEATHER_LOCATIONS],
+    default_interval=settings.WEATHER_POLL_INTERVAL_SECONDS,
+    jitter=settings.WEATHER_POLL_JITTER_SECONDS,
+    max_concurrency=settings.WEATHER_MAX_CONCURRENT_REQUESTS,
+)